@@ -1,5 +1,6 @@
 import logging
 from dataclasses import dataclass
+from multiprocessing.connection import Connection
 
 from aiomisc import entrypoint
 
@@ -22,11 +23,42 @@ def start_app(config: dataclass):
     :return:
     """
 
+    if config.webhook and not config.webhook_secret:
+        # Без секрета кто угодно может отправлять боту поддельные обновления
+        raise ValueError("WEBHOOK_SECRET is required when WEBHOOK=True")
+
     config_dependency(config)
     with entrypoint(
-        BotService(token=config.token),
+        BotService(
+            token=config.token,
+            webhook=config.webhook,
+            webhook_url=config.url,
+            webhook_secret=config.webhook_secret,
+        ),
         BotSubscriptionService(),
-        RESTfulService(port=config.port),
+        RESTfulService(
+            address=config.listen,
+            port=config.port,
+            webhook_secret=config.webhook_secret,
+        ),
+        log_level=logging.DEBUG if config.debug else logging.INFO,
+    ) as loop:
+        loop.run_forever()
+
+
+def start_worker(config: dataclass, connection: Connection, events: Connection):
+    """
+    Запускает процесс-обработчик обновлений, получаемых через connection
+
+    :param config: конфиг
+    :param connection: канал, по которому приходят обновления
+    :param events: канал, в который отправляются изменения подписок
+    :return:
+    """
+
+    config_dependency(config)
+    with entrypoint(
+        BotService(token=config.token, connection=connection, events=events),
         log_level=logging.DEBUG if config.debug else logging.INFO,
     ) as loop:
         loop.run_forever()
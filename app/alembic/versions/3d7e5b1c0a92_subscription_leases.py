@@ -0,0 +1,37 @@
+"""Subscription leases
+
+Revision ID: 3d7e5b1c0a92
+Revises: 8c3f1a2d9b47
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3d7e5b1c0a92"
+down_revision = "8c3f1a2d9b47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "subscription_leases",
+        sa.Column("id", sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column("owner", sa.String(length=128), nullable=True),
+        sa.Column("expires", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "subscription_workers",
+        sa.Column("owner", sa.String(length=128), nullable=False),
+        sa.Column("expires", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("owner"),
+    )
+
+
+def downgrade():
+    op.drop_table("subscription_workers")
+    op.drop_table("subscription_leases")
@@ -0,0 +1,36 @@
+"""Subscription changes
+
+Revision ID: 5a8d2f6b9c14
+Revises: e1a94c7d3f20
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5a8d2f6b9c14"
+down_revision = "e1a94c7d3f20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column(
+            "updated",
+            sa.TIMESTAMP(),
+            server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+            nullable=True,
+        ),
+    )
+    op.create_index(op.f("ix_users_updated"), "users", ["updated"], unique=False)
+    op.add_column("subscription_leases", sa.Column("sent", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("subscription_leases", "sent")
+    op.drop_index(op.f("ix_users_updated"), table_name="users")
+    op.drop_column("users", "updated")
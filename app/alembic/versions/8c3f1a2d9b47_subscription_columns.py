@@ -0,0 +1,120 @@
+"""Subscription columns
+
+Revision ID: 8c3f1a2d9b47
+Revises: 54e4361573ed
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8c3f1a2d9b47"
+down_revision = "54e4361573ed"
+branch_labels = None
+depends_on = None
+
+SUBSCRIPTION_DAYS = {
+    "Текущий день": "TODAY",
+    "Следующий день": "TOMORROW",
+    "Текущий и следующий день": "TODAY_AND_TOMORROW",
+    "Эта неделя": "THIS_WEEK",
+    "Следующая неделя": "NEXT_WEEK",
+}
+
+subscription_days_enum = sa.Enum(*SUBSCRIPTION_DAYS.values(), name="subscription_days")
+
+
+def upgrade():
+    bind = op.get_bind()
+    subscription_days_enum.create(bind, checkfirst=True)
+    op.add_column("users", sa.Column("subscription_minute", sa.SmallInteger()))
+    op.add_column("users", sa.Column("subscription_period", subscription_days_enum))
+
+    users = sa.table(
+        "users",
+        sa.column("id", sa.Integer()),
+        sa.column("subscription_time", sa.String()),
+        sa.column("subscription_days", sa.String()),
+        sa.column("subscription_minute", sa.SmallInteger()),
+        sa.column("subscription_period", sa.String()),
+    )
+    for id, time, days in bind.execute(
+        sa.select([users.c.id, users.c.subscription_time, users.c.subscription_days])
+    ).fetchall():
+        try:
+            hours, minutes = time.split(":")
+            minute = int(hours) * 60 + int(minutes)
+        except (AttributeError, ValueError):
+            minute = None
+        bind.execute(
+            users.update()
+            .where(users.c.id == id)
+            .values(
+                subscription_minute=minute,
+                subscription_period=SUBSCRIPTION_DAYS.get(days),
+            )
+        )
+
+    op.drop_column("users", "subscription_time")
+    op.drop_column("users", "subscription_days")
+    op.alter_column(
+        "users",
+        "subscription_minute",
+        new_column_name="subscription_time",
+        existing_type=sa.SmallInteger(),
+    )
+    op.alter_column(
+        "users",
+        "subscription_period",
+        new_column_name="subscription_days",
+        existing_type=subscription_days_enum,
+    )
+    op.create_index(op.f("ix_users_subscription_time"), "users", ["subscription_time"])
+
+
+def downgrade():
+    bind = op.get_bind()
+    op.drop_index(op.f("ix_users_subscription_time"), table_name="users")
+    op.add_column("users", sa.Column("subscription_clock", sa.String(length=256)))
+    op.add_column("users", sa.Column("subscription_text", sa.String(length=256)))
+
+    users = sa.table(
+        "users",
+        sa.column("id", sa.Integer()),
+        sa.column("subscription_time", sa.SmallInteger()),
+        sa.column("subscription_days", sa.String()),
+        sa.column("subscription_clock", sa.String()),
+        sa.column("subscription_text", sa.String()),
+    )
+    names = {value: name for name, value in SUBSCRIPTION_DAYS.items()}
+    for id, minute, days in bind.execute(
+        sa.select([users.c.id, users.c.subscription_time, users.c.subscription_days])
+    ).fetchall():
+        bind.execute(
+            users.update()
+            .where(users.c.id == id)
+            .values(
+                subscription_clock=None
+                if minute is None
+                else f"{minute // 60:02d}:{minute % 60:02d}",
+                subscription_text=names.get(days),
+            )
+        )
+
+    op.drop_column("users", "subscription_time")
+    op.drop_column("users", "subscription_days")
+    op.alter_column(
+        "users",
+        "subscription_clock",
+        new_column_name="subscription_time",
+        existing_type=sa.String(length=256),
+    )
+    op.alter_column(
+        "users",
+        "subscription_text",
+        new_column_name="subscription_days",
+        existing_type=sa.String(length=256),
+    )
+    subscription_days_enum.drop(bind, checkfirst=True)
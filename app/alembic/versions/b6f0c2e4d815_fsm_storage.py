@@ -0,0 +1,32 @@
+"""FSM storage
+
+Revision ID: b6f0c2e4d815
+Revises: 3d7e5b1c0a92
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b6f0c2e4d815"
+down_revision = "3d7e5b1c0a92"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "fsm_storage",
+        sa.Column("chat", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("user", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("state", sa.String(length=256), nullable=True),
+        sa.Column("data", sa.Text(), nullable=True),
+        sa.Column("bucket", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("chat", "user"),
+    )
+
+
+def downgrade():
+    op.drop_table("fsm_storage")
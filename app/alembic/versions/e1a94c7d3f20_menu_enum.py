@@ -0,0 +1,54 @@
+"""Menu enum
+
+Revision ID: e1a94c7d3f20
+Revises: b6f0c2e4d815
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e1a94c7d3f20"
+down_revision = "b6f0c2e4d815"
+branch_labels = None
+depends_on = None
+
+MENU = (
+    "START",
+    "CHOICE_GROUP",
+    "CHOICE_NAME",
+    "MAIN_MENU",
+    "SEARCH_GROUP",
+    "SEARCH_TEACHER",
+    "SEARCH_GROUP_DAY",
+    "SEARCH_TEACHER_DAY",
+    "SUBSCRIBE_CHOICE_TIME",
+)
+
+
+def upgrade():
+    users = sa.table("users", sa.column("menu", sa.String(length=256)))
+    op.execute(
+        users.update()
+        .where(sa.or_(users.c.menu.is_(None), users.c.menu.notin_(MENU)))
+        .values(menu="START")
+    )
+    op.alter_column(
+        "users",
+        "menu",
+        type_=sa.Enum(*MENU, name="menu"),
+        existing_type=sa.String(length=256),
+        existing_nullable=True,
+    )
+
+
+def downgrade():
+    op.alter_column(
+        "users",
+        "menu",
+        type_=sa.String(length=256),
+        existing_type=sa.Enum(*MENU, name="menu"),
+        existing_nullable=True,
+    )
@@ -7,6 +7,11 @@ from aiomysql.sa import create_engine, SAConnection
 from aiogram import Bot
 from aiomisc_dependency import dependency
 
+from app.ruz.server import RuzClient, setup_client
+from app.sender import MessageSender
+from app.webhook import UpdateQueue
+from app.workers import ShardedUpdates
+
 Connection = Callable[[], AsyncContextManager[SAConnection]]
 
 
@@ -26,6 +31,84 @@ def config_dependency(config: dataclass):
         engine.close()
         await engine.wait_closed()
 
+    @dependency
+    async def model(db: Connection):
+        """
+        Создает модель пользователей, общую для всех сервисов
+
+        :param db:
+        :return:
+        """
+
+        # app.model импортирует Connection из этого модуля
+        from app.model import Model
+
+        model = Model(
+            db,
+            write_behind=config.db_write_behind,
+            flush_interval=config.db_flush_interval / 1000,
+            flush_size=config.db_flush_size,
+        )
+
+        yield model
+        await model.close()
+
+    @dependency
+    async def subscriptions(db: Connection, model):
+        """
+        Создает индекс подписчиков по минутам рассылки
+
+        :param db:
+        :param model:
+        :return:
+        """
+
+        from app.subscriptions import SubscriptionIndex
+
+        index = SubscriptionIndex(db)
+        await index.load()
+        model.listeners.append(index.on_user_update)
+
+        yield index
+        model.listeners.remove(index.on_user_update)
+
+    @dependency
+    async def storage(db: Connection):
+        """
+        Создает хранилище состояний aiogram FSM, общее для всех процессов
+
+        :param db:
+        :return:
+        """
+
+        from app.storage import SQLStorage
+
+        storage = SQLStorage(db)
+
+        yield storage
+        await storage.close()
+
+    @dependency
+    async def leases(db: Connection):
+        """
+        Арендует части подписчиков, которые рассылает этот экземпляр бота
+
+        :param db:
+        :return:
+        """
+
+        from app.leases import PartitionLeases
+
+        leases = PartitionLeases(
+            db,
+            partitions=config.subscription_partitions,
+            ttl=config.subscription_lease_ttl,
+        )
+        await leases.start()
+
+        yield leases
+        await leases.close()
+
     @dependency
     async def bot() -> Bot:
         """
@@ -38,3 +121,67 @@ def config_dependency(config: dataclass):
 
         yield bot
         await bot.delete_webhook()
+
+    @dependency
+    async def sender(bot: Bot) -> MessageSender:
+        """
+        Создает общую очередь исходящих сообщений
+
+        :param bot:
+        :return:
+        """
+
+        rate = config.send_rate_limit
+        if config.workers > 1:
+            # Процессы-обработчики и этот процесс делят ограничение поровну
+            rate /= config.workers + 1
+        sender = MessageSender(bot, rate=rate, chat_rate=config.send_chat_rate_limit)
+        sender.start()
+
+        yield sender
+        await sender.close()
+
+    @dependency
+    async def ruz() -> RuzClient:
+        """
+        Создает клиент RUZ с общим пулом соединений
+
+        :return:
+        """
+
+        client = RuzClient(
+            limit_per_host=config.ruz_limit_per_host,
+            dns_cache_ttl=config.ruz_dns_cache_ttl,
+            fast_parser=config.ruz_fast_parser,
+            timeout=config.ruz_timeout,
+        )
+        setup_client(client)
+
+        yield client
+        setup_client(None)
+        await client.close()
+
+    @dependency
+    async def updates(model) -> UpdateQueue:
+        """
+        Создает очередь обновлений, полученных через webhook,
+        при workers > 1 обновления передаются в процессы-обработчики
+
+        :param model:
+        :return:
+        """
+
+        if config.workers > 1:
+            queue = ShardedUpdates(
+                config,
+                maxsize=config.webhook_queue_size,
+                on_user_update=model.apply_update,
+            )
+            queue.spawn()
+        else:
+            queue = UpdateQueue(
+                maxsize=config.webhook_queue_size, workers=config.webhook_workers
+            )
+
+        yield queue
+        await queue.close()
@@ -1,18 +1,28 @@
 import logging
 import datetime
-import asyncio
+from typing import Awaitable, Callable, Dict
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import ParseMode
 from aiogram.utils import exceptions
 from aiogram.types.reply_keyboard import ReplyKeyboardRemove
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
 from aiogram.utils.exceptions import MessageToDeleteNotFound
-from aiogram.utils.parts import safe_split_text
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH, safe_split_text
 
 from app.ruz.server import Group, Teacher, get_group, get_teacher, format_schedule
-from app.dependency import Connection
-from app.model import Model, User, UserFilteredByTime
+from app.model import (
+    Model,
+    User,
+    UserFilteredByTime,
+    Menu,
+    Period,
+    SUBSCRIPTION_DAYS,
+    time_to_minutes,
+    minutes_to_time,
+)
+from app.sender import MessageSender
 from app.keyboards import (
     standard_keyboard,
     inline_keyboard_search,
@@ -20,12 +30,44 @@ from app.keyboards import (
     inline_keyboard_calendar,
 )
 from app.utils import strings
+from app.utils.callback_router import CallbackRouter
 
 log = logging.getLogger(__name__)
 
+# Кнопки расписания главного меню
+MAIN_MENU_PERIODS = {
+    "Сегодня": Period(0, 1, "сегодня"),
+    "Завтра": Period(1, 1, "завтра"),
+    "Эта неделя": Period(-1, 7, "эту неделю"),
+    "Следующая неделя": Period(-2, 7, "следующую неделю"),
+}
+
+# Кнопки выбора дня при поиске группы или преподавателя
+SEARCH_PERIODS = {
+    "Текущий день": Period(0, 1, "этот день"),
+    "Следующий день": Period(1, 1, "следующий день"),
+    "Текущий и следующий день": Period(0, 2, "этот и следующий день"),
+    "Эта неделя": Period(-1, 7, "эту неделю"),
+    "Следующая неделя": Period(-2, 7, "следующую неделю"),
+}
+
+# Роль, расписание которой ищется в меню выбора дня
+SEARCH_DAY_TYPES = {
+    Menu.SEARCH_GROUP_DAY: "student",
+    Menu.SEARCH_TEACHER_DAY: "teacher",
+}
+
+# Название периода подписки в сообщении об оформлении, остальные кнопки
+# пишутся со строчной буквы
+SUBSCRIPTION_NAMES = {
+    "Эта неделя": "эту неделю",
+    "Следующая неделя": "следующую неделю",
+}
+
 
 class BotHelper:
     bot: Bot
+    sender: MessageSender
 
     @staticmethod
     async def get_schedule(
@@ -39,7 +81,7 @@ class BotHelper:
         show_location: bool = None,
     ) -> list:
         """
-        Отсылает пользователю расписание
+        Возвращает сообщения расписания для пользователя
 
         :param user:
         :param start_day: -1 - начало этой недели, -2 - начало следующей
@@ -49,7 +91,7 @@ class BotHelper:
         :param search_type:
         :param show_groups:
         :param show_location:
-        :return:
+        :return: сообщения не длиннее MAX_MESSAGE_LENGTH
         """
 
         if start_day == -1:
@@ -74,7 +116,12 @@ class BotHelper:
         if schedule is None:
             log.warning("Target [CHAT_ID:%s]: error getting schedule", user.id)
             return [strings.CANT_GET_SCHEDULE]
-        return safe_split_text(text + schedule)
+        if not text:
+            return list(schedule)
+        # Начальная строка дописывается к первому сообщению, если оно помещается
+        if len(text) + len(schedule[0]) > MAX_MESSAGE_LENGTH:
+            return [text, *schedule]
+        return [text + schedule[0], *schedule[1:]]
 
     async def send_message(
         self,
@@ -85,9 +132,10 @@ class BotHelper:
         disable_notification: bool = None,
         reply_to_message_id: int = None,
         reply_markup=None,
+        background: bool = False,
     ) -> True or False:
         """
-        Отправка сообщенея
+        Отправка сообщенея через общую очередь отправки
 
         :param chat_id:
         :param text:
@@ -96,6 +144,7 @@ class BotHelper:
         :param disable_notification:
         :param reply_to_message_id:
         :param reply_markup:
+        :param background: сообщение рассылки, уступает очередь ответам
         :return:
         """
 
@@ -108,7 +157,7 @@ class BotHelper:
 
         try:
             for text in parts:
-                await self.bot.send_message(
+                await self.sender.send_message(
                     chat_id=chat_id,
                     text=text,
                     parse_mode=parse_mode,
@@ -116,6 +165,7 @@ class BotHelper:
                     disable_notification=disable_notification,
                     reply_to_message_id=reply_to_message_id,
                     reply_markup=reply_markup,
+                    background=background,
                 )
         except exceptions.BotBlocked:
             log.error("Target [CHAT_ID:%s]: blocked by user", chat_id)
@@ -123,11 +173,10 @@ class BotHelper:
             log.error("Target [CHAT_ID:%s]: invalid user ID", chat_id)
         except exceptions.RetryAfter as e:
             log.error(
-                "Target [CHAT_ID:%s]: Flood limit is exceeded. Sleep %s seconds.",
+                "Target [CHAT_ID:%s]: Flood limit is exceeded. Retry after %s seconds.",
                 chat_id,
                 e.timeout,
             )
-            await asyncio.sleep(e.timeout)
         except exceptions.UserDeactivated:
             log.error("Target [CHAT_ID:%s]: user is deactivated", chat_id)
         except exceptions.TelegramAPIError:
@@ -141,13 +190,39 @@ class BotHelper:
 class BotDispatcher(Dispatcher, BotHelper):
     bot: Bot
     model: Model
-    storage: MemoryStorage
+    sender: MessageSender
+    storage: BaseStorage
+    callbacks: CallbackRouter
+    menu_handlers: Dict[str, Callable[..., Awaitable]]
+    main_menu_handlers: Dict[str, Callable[[User], Awaitable]]
 
     def __init__(
-        self, bot: Bot, db: Connection, storage: MemoryStorage = MemoryStorage()
+        self,
+        bot: Bot,
+        model: Model,
+        sender: MessageSender,
+        storage: BaseStorage = None,
     ):
-        super().__init__(bot, storage=storage)
-        self.model = Model(db)
+        super().__init__(bot, storage=storage or MemoryStorage())
+        self.model = model
+        self.sender = sender
+        self.callbacks = CallbackRouter()
+
+        # Обработчики текстовых сообщений по состоянию меню
+        self.menu_handlers = {
+            Menu.START: self._start_menu,
+            Menu.MAIN_MENU: self._main_menu,
+            Menu.CHOICE_GROUP: self._search_group,
+            Menu.SEARCH_GROUP: self._search_group,
+            Menu.CHOICE_NAME: self._search_teacher,
+            Menu.SEARCH_TEACHER: self._search_teacher,
+            Menu.SUBSCRIBE_CHOICE_TIME: self._subscribe_choice_time,
+        }
+        # Кнопки главного меню, кроме кнопок расписания
+        self.main_menu_handlers = {
+            "Поиск": self._main_menu_search,
+            "Настройки": self._main_menu_settings,
+        }
 
         # START/RESTART BOT
         self.register_message_handler(
@@ -158,115 +233,124 @@ class BotDispatcher(Dispatcher, BotHelper):
         self.register_message_handler(self.role_message, regexp="студент|преподаватель")
 
         # SEARCH GROUP/TEACHERS
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._list_groups_or_teachers_handler,
-            inline_keyboard_search.groups_list_callback.filter(),
+            inline_keyboard_search.groups_list_callback,
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._list_groups_or_teachers_handler,
-            inline_keyboard_search.teachers_list_callback.filter(),
+            inline_keyboard_search.teachers_list_callback,
         )
 
         # SEARCH IN MENU
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._schedule_specific_day,
-            inline_keyboard_search.menu_callback.filter(
-                menu="Расписание на определенный день"
-            ),
+            inline_keyboard_search.menu_callback,
+            menu="Расписание на определенный день",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._schedule_specific_teacher,
-            inline_keyboard_search.menu_callback.filter(
-                menu="Расписание преподавателя"
-            ),
+            inline_keyboard_search.menu_callback,
+            menu="Расписание преподавателя",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._schedule_specific_group,
-            inline_keyboard_search.menu_callback.filter(menu="Расписание группы"),
+            inline_keyboard_search.menu_callback,
+            menu="Расписание группы",
         )
 
         # CALENDAR
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_next_month,
-            inline_keyboard_calendar.calendar_callback.filter(action="Следующий месяц"),
+            inline_keyboard_calendar.calendar_callback,
+            action="Следующий месяц",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_previous_month,
-            inline_keyboard_calendar.calendar_callback.filter(
-                action="Предыдущий месяц"
-            ),
+            inline_keyboard_calendar.calendar_callback,
+            action="Предыдущий месяц",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_cancel,
-            inline_keyboard_calendar.calendar_callback.filter(action="Отмена"),
+            inline_keyboard_calendar.calendar_callback,
+            action="Отмена",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_exception,
-            inline_keyboard_calendar.calendar_callback.filter(action="Исключение"),
+            inline_keyboard_calendar.calendar_callback,
+            action="Исключение",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_months,
-            inline_keyboard_calendar.calendar_callback.filter(action="Месяца"),
+            inline_keyboard_calendar.calendar_callback,
+            action="Месяца",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_month,
-            inline_keyboard_calendar.calendar_callback.filter(action="Месяц"),
+            inline_keyboard_calendar.calendar_callback,
+            action="Месяц",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._calendar_day,
-            inline_keyboard_calendar.calendar_callback.filter(action="День"),
+            inline_keyboard_calendar.calendar_callback,
+            action="День",
         )
 
         # SETTINGS
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._settings_subscribe_to_time,
-            inline_keyboard_settings.settings_callback.filter(menu="Подписка на время"),
+            inline_keyboard_settings.settings_callback,
+            menu="Подписка на время",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._settings_unsubscribe,
-            inline_keyboard_settings.settings_callback.filter(menu="Отписаться"),
+            inline_keyboard_settings.settings_callback,
+            menu="Отписаться",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._settings_displayed_fields,
-            inline_keyboard_settings.settings_callback.filter(menu="Показываемые поля"),
+            inline_keyboard_settings.settings_callback,
+            menu="Показываемые поля",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._settings_back,
-            inline_keyboard_settings.settings_callback.filter(menu="Настройки"),
+            inline_keyboard_settings.settings_callback,
+            menu="Настройки",
         )
 
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._settings_displayed_fields_menu,
-            inline_keyboard_settings.settings_callback.filter(
-                menu=["Группы в расписании", "Место в расписании"]
-            ),
+            inline_keyboard_settings.settings_callback,
+            menu=["Группы в расписании", "Место в расписании"],
         )
 
         # SUBSCRIBE
-        self.register_callback_query_handler(
-            self._choice_day_schedule,
-            inline_keyboard_settings.subscribe_time_callback.filter(),
+        self.callbacks.register(
+            self._choice_time_schedule,
+            inline_keyboard_settings.subscribe_time_callback,
         )
-        self.register_callback_query_handler(
+        self.callbacks.register(
             self._choice_day_schedule,
-            inline_keyboard_settings.subscribe_day_callback.filter(),
+            inline_keyboard_settings.subscribe_day_callback,
         )
 
+        self.register_callback_query_handler(self.callbacks)
+
         # OTHER MESSAGES
         self.register_message_handler(self.check_other_messages, content_types=["text"])
 
@@ -284,7 +368,7 @@ class BotDispatcher(Dispatcher, BotHelper):
             data=dict(
                 id=message.from_user.id,
                 role=None,
-                menu="START",
+                menu=Menu.START,
                 search_id=None,
                 search_display=None,
                 subscription_time=None,
@@ -313,7 +397,7 @@ class BotDispatcher(Dispatcher, BotHelper):
 
         if message.text == "Студент":
             await self.model.update_user(
-                user.id, data=dict(id=user.id, role="student", menu="CHOICE_GROUP"),
+                user.id, data=dict(id=user.id, role="student", menu=Menu.CHOICE_GROUP),
             )
             await self.send_message(
                 user.id, text=strings.GROUP_EXAMPLE, reply_markup=ReplyKeyboardRemove(),
@@ -324,7 +408,7 @@ class BotDispatcher(Dispatcher, BotHelper):
                 data=dict(
                     id=user.id,
                     role="teacher",
-                    menu="CHOICE_NAME",
+                    menu=Menu.CHOICE_NAME,
                     show_location=True,
                     show_groups=True,
                 ),
@@ -339,40 +423,43 @@ class BotDispatcher(Dispatcher, BotHelper):
         """
         Обрабатывает сообщения, которые не может обработать handler
 
+        Обработчик выбирается по состоянию меню пользователя
+
         :param message:
         :return:
         """
 
         user = await self.model.get_user(message.from_user.id)
 
-        if user.menu == "MAIN_MENU":
-            await self._main_menu(user=user, message=message)
-        elif user.menu == "CHOICE_GROUP" or user.menu == "SEARCH_GROUP":
-            await self._search_group(user=user, message=message)
-        elif user.menu == "CHOICE_NAME" or user.menu == "SEARCH_TEACHER":
-            await self._search_teacher(user=user, message=message)
-        elif user.menu == "SUBSCRIBE_CHOICE_TIME":
-            data = dict(menu="MAIN_MENU", subscription_id=user.search_id,)
-            try:
-                subscribe_time = datetime.datetime.strptime(
-                    message.text, "%H:%M"
-                ).strftime("%H:%M")
-                data["subscription_time"] = subscribe_time
-                await self.model.update_user(user.id, data=data)
-                keyboard = await inline_keyboard_settings.choice_day_keyboard()
-                await self.send_message(
-                    chat_id=user.id,
-                    text=strings.DISPLAY_SCHEDULE,
-                    reply_markup=keyboard,
-                )
-            except ValueError:
-                await self.send_message(
-                    chat_id=user.id, text="Выберите другое время",
-                )
-        elif user.menu == "START":
-            await self.start_message(message)
-        else:
+        handler = self.menu_handlers.get(user.menu)
+        if handler is None:
             log.warning("Target [CHAT_ID:%s]: not found menu", user.id)
+            return
+        await handler(user=user, message=message)
+
+    async def _start_menu(self, user: User, message: types.Message) -> None:
+        await self.start_message(message)
+
+    async def _subscribe_choice_time(self, user: User, message: types.Message) -> None:
+        """
+        Обрабатывает время подписки, введенное сообщением
+
+        :param user:
+        :param message:
+        :return:
+        """
+
+        data = dict(menu=Menu.MAIN_MENU, subscription_id=user.search_id)
+        try:
+            subscribe_time = datetime.datetime.strptime(message.text, "%H:%M")
+            data["subscription_time"] = subscribe_time.hour * 60 + subscribe_time.minute
+            await self.model.update_user(user.id, data=data)
+            keyboard = await inline_keyboard_settings.choice_day_keyboard()
+            await self.send_message(
+                chat_id=user.id, text=strings.DISPLAY_SCHEDULE, reply_markup=keyboard
+            )
+        except ValueError:
+            await self.send_message(chat_id=user.id, text="Выберите другое время")
 
     async def _main_menu(self, user: User, message: types.Message) -> None:
         """
@@ -383,54 +470,39 @@ class BotDispatcher(Dispatcher, BotHelper):
         :return:
         """
 
-        select = message.text
-        if select == "Сегодня":
-            self.loop.create_task(
-                self.send_message(
-                    chat_id=user.id,
-                    text=await self.get_schedule(user=user, start_day=0, days=1),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-            )
-        elif select == "Завтра":
+        period = MAIN_MENU_PERIODS.get(message.text)
+        if period is not None:
             self.loop.create_task(
                 self.send_message(
                     chat_id=user.id,
-                    text=await self.get_schedule(user=user, start_day=1, days=1),
+                    text=await self.get_schedule(
+                        user=user, start_day=period.start_day, days=period.days
+                    ),
                     parse_mode=ParseMode.MARKDOWN,
                 )
             )
-        elif select == "Эта неделя":
-            self.loop.create_task(
-                self.send_message(
-                    user.id,
-                    text=await self.get_schedule(user=user, start_day=-1, days=7),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-            )
-        elif select == "Следующая неделя":
-            self.loop.create_task(
-                self.send_message(
-                    user.id,
-                    text=await self.get_schedule(user=user, start_day=-2, days=7),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-            )
-        elif select == "Поиск":
-            keyboard = await inline_keyboard_search.search_keyboard(user=user)
-            await self.send_message(
-                chat_id=user.id, text=strings.WHAT_TO_FIND, reply_markup=keyboard
-            )
-        elif select == "Настройки":
-            keyboard = await inline_keyboard_settings.settings(user=user)
-            await self.send_message(
-                chat_id=user.id, text=strings.WHAT_TO_SET, reply_markup=keyboard,
-            )
-        else:
-            keyboard = await standard_keyboard.main_keyboard()
-            await self.send_message(
-                chat_id=user.id, text=strings.WHAT_TO_SET, reply_markup=keyboard,
-            )
+            return
+
+        handler = self.main_menu_handlers.get(message.text, self._main_menu_keyboard)
+        await handler(user)
+
+    async def _main_menu_search(self, user: User) -> None:
+        keyboard = await inline_keyboard_search.search_keyboard(user=user)
+        await self.send_message(
+            chat_id=user.id, text=strings.WHAT_TO_FIND, reply_markup=keyboard
+        )
+
+    async def _main_menu_settings(self, user: User) -> None:
+        keyboard = await inline_keyboard_settings.settings(user=user)
+        await self.send_message(
+            chat_id=user.id, text=strings.WHAT_TO_SET, reply_markup=keyboard
+        )
+
+    async def _main_menu_keyboard(self, user: User) -> None:
+        keyboard = await standard_keyboard.main_keyboard()
+        await self.send_message(
+            chat_id=user.id, text=strings.WHAT_TO_SET, reply_markup=keyboard
+        )
 
     async def _search_group(self, user: User, message: types.Message) -> None:
         """
@@ -446,12 +518,12 @@ class BotDispatcher(Dispatcher, BotHelper):
 
         if isinstance(groups.data, list) and groups.has_error is False and groups.data:
             if len(groups.data) == 1:
-                if user.menu == "SEARCH_GROUP":
+                if user.menu == Menu.SEARCH_GROUP:
                     await self.model.update_user(
                         id=user.id,
                         data=dict(
                             search_additional=groups.data[0].id,
-                            menu="SEARCH_GROUP_DAY",
+                            menu=Menu.SEARCH_GROUP_DAY,
                         ),
                     )
                     await self.send_message(
@@ -465,7 +537,7 @@ class BotDispatcher(Dispatcher, BotHelper):
                         data=dict(
                             search_id=groups.data[0].id,
                             search_display=groups.data[0].name,
-                            menu="MAIN_MENU",
+                            menu=Menu.MAIN_MENU,
                         ),
                     )
                     await self.send_message(
@@ -477,7 +549,12 @@ class BotDispatcher(Dispatcher, BotHelper):
                     )
             else:
                 keyboard = await inline_keyboard_search.list_groups(groups=groups.data)
-                await message.reply(strings.CHOOSE_GROUP, reply_markup=keyboard)
+                await self.send_message(
+                    chat_id=user.id,
+                    text=strings.CHOOSE_GROUP,
+                    reply_to_message_id=message.message_id,
+                    reply_markup=keyboard,
+                )
 
         else:
             await self.send_message(
@@ -504,12 +581,12 @@ class BotDispatcher(Dispatcher, BotHelper):
             and teachers.data
         ):
             if len(teachers.data) == 1:
-                if user.menu == "SEARCH_TEACHER":
+                if user.menu == Menu.SEARCH_TEACHER:
                     await self.model.update_user(
                         id=user.id,
                         data=dict(
                             search_additional=teachers.data[0].id,
-                            menu="SEARCH_TEACHER_DAY",
+                            menu=Menu.SEARCH_TEACHER_DAY,
                         ),
                     )
                     await self.send_message(
@@ -523,7 +600,7 @@ class BotDispatcher(Dispatcher, BotHelper):
                         data=dict(
                             search_id=teachers.data[0].id,
                             search_display=teachers.data[0].name,
-                            menu="MAIN_MENU",
+                            menu=Menu.MAIN_MENU,
                         ),
                     )
                     await self.send_message(
@@ -537,8 +614,11 @@ class BotDispatcher(Dispatcher, BotHelper):
                 keyboard = await inline_keyboard_search.list_teacher(
                     teachers=teachers.data
                 )
-                await message.reply(
-                    strings.CHOOSE_CURRENT_TEACHER, reply_markup=keyboard
+                await self.send_message(
+                    chat_id=user.id,
+                    text=strings.CHOOSE_CURRENT_TEACHER,
+                    reply_to_message_id=message.message_id,
+                    reply_markup=keyboard,
                 )
         else:
             await self.send_message(
@@ -561,16 +641,16 @@ class BotDispatcher(Dispatcher, BotHelper):
         user = await self.model.get_user(query.from_user.id)
         if callback_data["@"] == "g":
             data = Group(id=callback_data["id"], name=callback_data["name"])
-            search_day = "SEARCH_GROUP_DAY"
+            search_day = Menu.SEARCH_GROUP_DAY
             edit_text = strings.GROUP_CHANGED_FOR.format(data.name)
         elif callback_data["@"] == "t":
             data = Teacher(id=callback_data["id"], name=callback_data["name"])
-            search_day = "SEARCH_TEACHER_DAY"
+            search_day = Menu.SEARCH_TEACHER_DAY
             edit_text = strings.TEACHER_CHANGED_FOR.format(data.name)
         else:
             raise TypeError
 
-        if user.menu == "SEARCH_GROUP" or user.menu == "SEARCH_TEACHER":
+        if user.menu == Menu.SEARCH_GROUP or user.menu == Menu.SEARCH_TEACHER:
             await self.model.update_user(
                 id=user.id, data=dict(search_additional=data.id, menu=search_day),
             )
@@ -582,7 +662,7 @@ class BotDispatcher(Dispatcher, BotHelper):
             await self.model.update_user(
                 id=user.id,
                 data=dict(
-                    search_id=data.id, search_display=data.name, menu="MAIN_MENU",
+                    search_id=data.id, search_display=data.name, menu=Menu.MAIN_MENU,
                 ),
             )
             await query.message.edit_text(edit_text)
@@ -602,7 +682,7 @@ class BotDispatcher(Dispatcher, BotHelper):
 
         user_id = query.from_user.id
         await self.model.update_user(
-            user_id, data=dict(menu="SUBSCRIBE_CHOICE_TIME"),
+            user_id, data=dict(menu=Menu.SUBSCRIBE_CHOICE_TIME),
         )
         await query.message.delete()
         await self.send_message(
@@ -692,129 +772,152 @@ class BotDispatcher(Dispatcher, BotHelper):
                 strings.DISPLAY_SCHEDULE, reply_markup=keyboard
             )
 
+    async def _choice_time_schedule(
+        self, query: types.CallbackQuery, callback_data: dict
+    ) -> None:
+        """
+        Обрабатывает выбор времени подписки
+
+        :param query:
+        :param callback_data:
+        :return:
+        """
+
+        user = await self.model.get_user(query.from_user.id)
+        time = callback_data["time"]
+        if time == "Отмена":
+            await self.loop.create_task(self._unsubscribe_to_schedule(user))
+            await query.message.edit_text(strings.UNSUBSCRIBE_SCHEDULE)
+        else:
+            await self.model.update_user(
+                user.id,
+                data=dict(
+                    subscription_id=user.search_id,
+                    subscription_time=time_to_minutes(time),
+                ),
+            )
+            keyboard = await inline_keyboard_settings.choice_day_keyboard()
+            await query.message.edit_text(
+                strings.DISPLAY_SCHEDULE, reply_markup=keyboard
+            )
+
     async def _choice_day_schedule(
         self, query: types.CallbackQuery, callback_data: dict
     ) -> None:
         """
         Обрабатывает выбор дня
 
+        В меню поиска показывает расписание, в остальных случаях оформляет подписку
+
         :param query:
         :param callback_data:
         :return:
         """
 
         user = await self.model.get_user(query.from_user.id)
-        if callback_data["@"] == "sub_t":
-            time = callback_data["time"]
-            if time == "Отмена":
-                await self.loop.create_task(self._unsubscribe_to_schedule(user))
-                await query.message.edit_text(strings.UNSUBSCRIBE_SCHEDULE)
-            else:
-                await self.model.update_user(
-                    user.id,
-                    data=dict(subscription_id=user.search_id, subscription_time=time,),
-                )
-                keyboard = await inline_keyboard_settings.choice_day_keyboard()
-                await query.message.edit_text(
-                    strings.DISPLAY_SCHEDULE, reply_markup=keyboard
-                )
-        elif callback_data["@"] == "sub_d":
-            day = callback_data["day"]
+        search_type = SEARCH_DAY_TYPES.get(user.menu)
+        if search_type is None:
+            await self._choice_day_subscription(user, query, callback_data["day"])
+        else:
+            await self._choice_day_search(
+                user, query, callback_data["day"], search_type
+            )
 
-            if user.menu == "SEARCH_GROUP_DAY" or user.menu == "SEARCH_TEACHER_DAY":
-                if day == "Отмена":
-                    await query.message.edit_text(strings.CANCEL)
-                    await self.model.update_user(
-                        user.id, data=dict(menu="MAIN_MENU", search_additional=None,),
-                    )
-                    await self.send_message(
-                        chat_id=user.id,
-                        text=strings.CHOOSE_MENU,
-                        reply_markup=await standard_keyboard.main_keyboard(),
-                    )
-                else:
+    async def _choice_day_search(
+        self, user: User, query: types.CallbackQuery, day: str, search_type: str
+    ) -> None:
+        """
+        Показывает расписание найденной группы или преподавателя
 
-                    if day == "Эта неделя":
-                        start_day = -1
-                        days = 7
-                        day = "эту неделю"
-                    elif day == "Следующая неделя":
-                        start_day = -2
-                        days = 7
-                        day = "следующую неделю"
-                    elif day == "Текущий и следующий день":
-                        day = "этот и следующий день"
-                        start_day = 0
-                        days = 2
-                    elif day == "Текущий день":
-                        start_day = 0
-                        days = 1
-                        day = "этот день"
-                    elif day == "Следующий день":
-                        start_day = 1
-                        days = 1
-                        day = "следующий день"
-                    else:
-                        log.error(
-                            "Target [CHAT_ID:%s]: error name schedule on search other group/teacher",
-                            user.id,
-                        )
-                        raise NameError
-                    await self.model.update_user(
-                        user.id, data=dict(menu="MAIN_MENU", search_additional=None,),
-                    )
+        :param user:
+        :param query:
+        :param day: кнопка выбора дня
+        :param search_type:
+        :return:
+        """
 
-                    if user.menu == "SEARCH_GROUP_DAY":
-                        search_type = "student"
-                    else:
-                        search_type = "teacher"
-                    await query.answer(f"Загружаем расписание")
-                    await query.message.delete()
-                    schedule = await self.get_schedule(
-                        user=user,
-                        start_day=start_day,
-                        days=days,
-                        search_id=int(user.search_additional),
-                        search_type=search_type,
-                        text=f"Расписание на {day}\n\n",
-                    )
-                    await self.send_message(
-                        chat_id=user.id,
-                        text=schedule + [strings.CHOOSE_MENU],
-                        reply_markup=await standard_keyboard.main_keyboard(),
-                        parse_mode=ParseMode.MARKDOWN,
-                    )
-            else:  # Подписки
-                if day == "Отмена":
-                    self.loop.create_task(self._unsubscribe_to_schedule(user))
-                    await query.message.edit_text(strings.UNSUBSCRIBE_SCHEDULE)
-                    await self.send_message(
-                        chat_id=user.id,
-                        text=strings.CHOOSE_MENU,
-                        reply_markup=await standard_keyboard.main_keyboard(),
-                    )
-                else:
-                    self.loop.create_task(
-                        self.model.update_user(
-                            user.id, data=dict(subscription_days=day, menu="MAIN_MENU"),
-                        )
-                    )
-                    if day == "Эта неделя":
-                        day = "эту неделю"
-                    elif day == "Следующая неделя":
-                        day = "следующую неделю"
-                    else:
-                        day = day.lower()
-
-                    await query.message.delete()
-                    keyboard = await standard_keyboard.main_keyboard()
-                    await self.send_message(
-                        chat_id=user.id,
-                        text=f"Подписка на рассылку успешно сформирована\n\n"
-                        f"Теперь каждый день в {user.subscription_time} вы будете получать расписание на {day}\n\n"
-                        + strings.CHOOSE_MENU,
-                        reply_markup=keyboard,
-                    )
+        if day == "Отмена":
+            await query.message.edit_text(strings.CANCEL)
+            await self.model.update_user(
+                user.id, data=dict(menu=Menu.MAIN_MENU, search_additional=None)
+            )
+            await self.send_message(
+                chat_id=user.id,
+                text=strings.CHOOSE_MENU,
+                reply_markup=await standard_keyboard.main_keyboard(),
+            )
+            return
+
+        period = SEARCH_PERIODS.get(day)
+        if period is None:
+            log.error(
+                "Target [CHAT_ID:%s]: error name schedule on search other group/teacher",
+                user.id,
+            )
+            raise NameError
+        await self.model.update_user(
+            user.id, data=dict(menu=Menu.MAIN_MENU, search_additional=None)
+        )
+
+        await query.answer(f"Загружаем расписание")
+        await query.message.delete()
+        schedule = await self.get_schedule(
+            user=user,
+            start_day=period.start_day,
+            days=period.days,
+            search_id=int(user.search_additional),
+            search_type=search_type,
+            text=f"Расписание на {period.text}\n\n",
+        )
+        await self.send_message(
+            chat_id=user.id,
+            text=schedule + [strings.CHOOSE_MENU],
+            reply_markup=await standard_keyboard.main_keyboard(),
+            parse_mode=ParseMode.MARKDOWN,
+        )
+
+    async def _choice_day_subscription(
+        self, user: User, query: types.CallbackQuery, day: str
+    ) -> None:
+        """
+        Оформляет подписку на выбранный период
+
+        :param user:
+        :param query:
+        :param day: кнопка выбора дня
+        :return:
+        """
+
+        if day == "Отмена":
+            self.loop.create_task(self._unsubscribe_to_schedule(user))
+            await query.message.edit_text(strings.UNSUBSCRIBE_SCHEDULE)
+            await self.send_message(
+                chat_id=user.id,
+                text=strings.CHOOSE_MENU,
+                reply_markup=await standard_keyboard.main_keyboard(),
+            )
+            return
+
+        self.loop.create_task(
+            self.model.update_user(
+                user.id,
+                data=dict(
+                    subscription_days=SUBSCRIPTION_DAYS[day], menu=Menu.MAIN_MENU
+                ),
+            )
+        )
+
+        await query.message.delete()
+        keyboard = await standard_keyboard.main_keyboard()
+        subscription_time = minutes_to_time(user.subscription_time)
+        await self.send_message(
+            chat_id=user.id,
+            text=f"Подписка на рассылку успешно сформирована\n\n"
+            f"Теперь каждый день в {subscription_time} "
+            f"вы будете получать расписание на {SUBSCRIPTION_NAMES.get(day, day.lower())}\n\n"
+            + strings.CHOOSE_MENU,
+            reply_markup=keyboard,
+        )
 
     async def _unsubscribe_to_schedule(self, user: User) -> None:
         """
@@ -827,7 +930,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         await self.model.update_user(
             user.id,
             data=dict(
-                menu="MAIN_MENU",
+                menu=Menu.MAIN_MENU,
                 subscription_id=None,
                 subscription_time=None,
                 subscription_days=None,
@@ -881,7 +984,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         current = datetime.datetime(int(year), int(month), 1)
 
         next_month = current + datetime.timedelta(days=31)
-        keyboard = await inline_keyboard_calendar.create_calendar(
+        keyboard = inline_keyboard_calendar.calendar_json(
             int(next_month.year), int(next_month.month)
         )
         await query.message.edit_text(text=query.message.text, reply_markup=keyboard)
@@ -908,7 +1011,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         current = datetime.datetime(int(year), int(month), 1)
 
         preview_month = current - datetime.timedelta(days=1)
-        keyboard = await inline_keyboard_calendar.create_calendar(
+        keyboard = inline_keyboard_calendar.calendar_json(
             year=int(preview_month.year), month=int(preview_month.month)
         )
         await query.message.edit_text(text=query.message.text, reply_markup=keyboard)
@@ -930,7 +1033,7 @@ class BotDispatcher(Dispatcher, BotHelper):
             callback_data["year"],
         )
 
-        keyboard = await inline_keyboard_calendar.create_calendar(
+        keyboard = inline_keyboard_calendar.calendar_json(
             year=int(year), month=int(month)
         )
         await query.message.edit_text(text=query.message.text, reply_markup=keyboard)
@@ -954,9 +1057,7 @@ class BotDispatcher(Dispatcher, BotHelper):
 
         current = datetime.datetime(int(year), int(month), 1)
 
-        keyboard = await inline_keyboard_calendar.create_months_calendar(
-            year=current.year
-        )
+        keyboard = inline_keyboard_calendar.months_calendar_json(year=current.year)
         await query.message.edit_text(text=query.message.text, reply_markup=keyboard)
 
     @staticmethod
@@ -996,7 +1097,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         now = datetime.datetime.now()
         await query.message.edit_text(
             strings.SELECT_DAY_IN_CALENDAR,
-            reply_markup=await inline_keyboard_calendar.create_calendar(
+            reply_markup=inline_keyboard_calendar.calendar_json(
                 year=now.year, month=now.month
             ),
         )
@@ -1012,7 +1113,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         user_id = query.from_user.id
         await query.message.delete()
         await self.model.update_user(
-            user_id, data=dict(menu="SEARCH_GROUP", search_additional="CHANGES",),
+            user_id, data=dict(menu=Menu.SEARCH_GROUP, search_additional="CHANGES",),
         )
         await self.send_message(
             chat_id=user_id,
@@ -1031,7 +1132,7 @@ class BotDispatcher(Dispatcher, BotHelper):
         user_id = query.from_user.id
         await query.message.delete()
         await self.model.update_user(
-            user_id, data=dict(menu="SEARCH_TEACHER", search_additional="CHANGES",),
+            user_id, data=dict(menu=Menu.SEARCH_TEACHER, search_additional="CHANGES",),
         )
         await self.send_message(
             chat_id=user_id,
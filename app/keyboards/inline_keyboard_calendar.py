@@ -1,29 +1,68 @@
 import datetime
 import calendar
+from functools import lru_cache
+from typing import Tuple
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.callback_data import CallbackData
+from aiogram.utils.payload import prepare_arg
 
 from app.utils.strings import CALENDAR_MONTHS, CALENDAR_DAYS
 
 calendar_callback = CallbackData("ca", "action", "year", "month", "day")
 
 
+def calendar_key(year: int = None, month: int = None) -> Tuple[int, int, int]:
+    """
+    Ключ кэша календаря
+
+    :param year: по умолчанию текущий год
+    :param month: по умолчанию текущий месяц
+    :return: год, месяц и текущий день, если он в этом месяце, иначе 0
+    """
+
+    today = datetime.date.today()
+    year = today.year if year is None else year
+    month = today.month if month is None else month
+    return year, month, today.day if (year, month) == (today.year, today.month) else 0
+
+
 async def create_calendar(year: int = None, month: int = None) -> InlineKeyboardMarkup:
     """
     Создайт встроенную inline клавиатуру с календарем
 
+    Клавиатура общая для всех вызовов с теми же аргументами, ее нельзя изменять
+
     :param year: Год для использования в календаре, если не используется текущий год.
     :param month: Месяц для использования в календаре, если не используется текущий месяц.
     :return: Возвращает объект InlineKeyboardMarkup с календарем.
     """
 
-    now_day = datetime.datetime.now()
+    return _calendar(*calendar_key(year, month))[0]
+
+
+def calendar_json(year: int = None, month: int = None) -> str:
+    """
+    Календарь, сериализованный для reply_markup
+
+    :param year: по умолчанию текущий год
+    :param month: по умолчанию текущий месяц
+    :return:
+    """
+
+    return _calendar(*calendar_key(year, month))[1]
 
-    if year is None:
-        year = now_day.year
-    if month is None:
-        month = now_day.month
+
+@lru_cache(maxsize=256)
+def _calendar(year: int, month: int, today: int) -> Tuple[InlineKeyboardMarkup, str]:
+    """
+    Строит календарь месяца
+
+    :param year:
+    :param month:
+    :param today: день, отмечаемый как текущий, 0 - не отмечать
+    :return: клавиатура и ее JSON
+    """
 
     keyboard_markup = InlineKeyboardMarkup(row_width=7)
 
@@ -60,10 +99,7 @@ async def create_calendar(year: int = None, month: int = None) -> InlineKeyboard
                         ),
                     )
                 )
-            elif (
-                f"{now_day.day}.{now_day.month}.{now_day.year}"
-                == f"{day}.{month}.{year}"
-            ):
+            elif day == today:
                 row.append(
                     InlineKeyboardButton(
                         f"({day})",
@@ -104,19 +140,41 @@ async def create_calendar(year: int = None, month: int = None) -> InlineKeyboard
         ),
     )
 
-    return keyboard_markup
+    return keyboard_markup, prepare_arg(keyboard_markup)
 
 
 async def create_months_calendar(year: int = None) -> InlineKeyboardMarkup:
     """
     Создает календарь с выбором месяца
 
+    Клавиатура общая для всех вызовов с тем же годом, ее нельзя изменять
+
     :param year: Год
     :return:
     """
 
-    if year is None:
-        year = datetime.datetime.now().year
+    return _months_calendar(year or datetime.date.today().year)[0]
+
+
+def months_calendar_json(year: int = None) -> str:
+    """
+    Календарь с выбором месяца, сериализованный для reply_markup
+
+    :param year: по умолчанию текущий год
+    :return:
+    """
+
+    return _months_calendar(year or datetime.date.today().year)[1]
+
+
+@lru_cache(maxsize=16)
+def _months_calendar(year: int) -> Tuple[InlineKeyboardMarkup, str]:
+    """
+    Строит календарь с выбором месяца
+
+    :param year:
+    :return: клавиатура и ее JSON
+    """
 
     keyboard_markup = InlineKeyboardMarkup()
 
@@ -136,4 +194,4 @@ async def create_months_calendar(year: int = None) -> InlineKeyboardMarkup:
             ),
         )
 
-    return keyboard_markup
+    return keyboard_markup, prepare_arg(keyboard_markup)
@@ -2,6 +2,7 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.callback_data import CallbackData
 
 from app.model import User
+from app.keyboards.registry import static_keyboard, cached_keyboard
 from app.utils import strings
 
 settings_callback = CallbackData("sett", "menu")
@@ -9,7 +10,7 @@ subscribe_time_callback = CallbackData("sub_t", "time", sep="|")
 subscribe_day_callback = CallbackData("sub_d", "day", sep="|")
 
 
-async def settings(user: User) -> InlineKeyboardMarkup:
+async def settings(user: User) -> str:
     """
     Возвращает inline клавиатуру настроек
 
@@ -17,14 +18,42 @@ async def settings(user: User) -> InlineKeyboardMarkup:
     :return:
     """
 
+    return await _settings(
+        user.role,
+        user.search_id,
+        user.search_display,
+        user.subscription_time is None or user.subscription_id is None,
+        user.subscription_days,
+    )
+
+
+@cached_keyboard()
+def _settings(
+    role: str,
+    search_id: str,
+    search_display: str,
+    not_subscribed: bool,
+    subscription_days: str,
+) -> InlineKeyboardMarkup:
+    """
+    Строит inline клавиатуру настроек по полям пользователя, от которых она зависит
+
+    :param role:
+    :param search_id:
+    :param search_display:
+    :param not_subscribed: не задано время или расписание подписки
+    :param subscription_days:
+    :return:
+    """
+
     keyboard_markup = InlineKeyboardMarkup(row_width=1)
 
-    if user.role and user.search_id:
-        if user.role == "teacher":
-            role = "lecturer"
+    if role and search_id:
+        if role == "teacher":
+            search_type = "lecturer"
         else:
-            role = "group"
-        url = f"{strings.SUBSCRIBE_URL}?name={user.search_display}&type={role}&id={user.search_id}".replace(
+            search_type = "group"
+        url = f"{strings.SUBSCRIBE_URL}?name={search_display}&type={search_type}&id={search_id}".replace(
             " ", "+"
         )
         keyboard_markup.row(InlineKeyboardButton("Добавить в календарь 📲", url=url,))
@@ -36,15 +65,7 @@ async def settings(user: User) -> InlineKeyboardMarkup:
         )
     )
 
-    if (
-        user.role
-        and user.search_id
-        and (
-            user.subscription_time is None
-            or user.subscription_id is None
-            or user.subscription_time is None
-        )
-    ):
+    if role and search_id and not_subscribed:
         keyboard_markup.row(
             InlineKeyboardButton(
                 "Подписаться на расписание",
@@ -52,8 +73,8 @@ async def settings(user: User) -> InlineKeyboardMarkup:
             )
         )
     else:
-        if user.subscription_days is not None and user.subscription_days != "CHANGES":
-            if user.role and user.search_id:
+        if subscription_days is not None and subscription_days != "CHANGES":
+            if role and search_id:
                 keyboard_markup.row(
                     InlineKeyboardButton(
                         "Изменить подписку на расписание",
@@ -70,9 +91,8 @@ async def settings(user: User) -> InlineKeyboardMarkup:
     return keyboard_markup
 
 
-async def display_in_schedule(
-    show_groups: bool, show_location: bool
-) -> InlineKeyboardMarkup:
+@cached_keyboard(maxsize=16)
+def display_in_schedule(show_groups: bool, show_location: bool) -> InlineKeyboardMarkup:
     """
     Возвращает inline клавиатуру показа полей в расписании
 
@@ -104,7 +124,8 @@ async def display_in_schedule(
     return keyboard_markup
 
 
-async def subscribe_choice_time_keyboard() -> InlineKeyboardMarkup:
+@static_keyboard
+def subscribe_choice_time_keyboard() -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру выбора времени подписки
 
@@ -155,7 +176,8 @@ async def subscribe_choice_time_keyboard() -> InlineKeyboardMarkup:
     return keyboard_markup
 
 
-async def choice_day_keyboard() -> InlineKeyboardMarkup:
+@static_keyboard
+def choice_day_keyboard() -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру выбора дня подписки
 
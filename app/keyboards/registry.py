@@ -0,0 +1,53 @@
+from functools import lru_cache, wraps
+from typing import Awaitable, Callable, Dict, Union
+
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+from aiogram.utils.payload import prepare_arg
+
+Markup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]
+
+# Сериализованные неизменяемые клавиатуры по имени функции
+keyboards: Dict[str, str] = dict()
+
+
+def static_keyboard(build: Callable[[], Markup]) -> Callable[[], Awaitable[str]]:
+    """
+    Строит клавиатуру один раз при импорте
+
+    Функция возвращает сериализованную клавиатуру, которую aiogram передает
+    в reply_markup без изменений
+
+    :param build: функция, создающая клавиатуру
+    :return:
+    """
+
+    payload = keyboards[f"{build.__module__}.{build.__name__}"] = prepare_arg(build())
+
+    @wraps(build)
+    async def keyboard() -> str:
+        return payload
+
+    return keyboard
+
+
+def cached_keyboard(maxsize: int = 1024):
+    """
+    Кэширует сериализованную клавиатуру по аргументам функции
+
+    :param maxsize: максимальное количество клавиатур в кэше
+    :return:
+    """
+
+    def decorator(build: Callable[..., Markup]) -> Callable[..., Awaitable[str]]:
+        @lru_cache(maxsize=maxsize)
+        def payload(*args, **kwargs) -> str:
+            return prepare_arg(build(*args, **kwargs))
+
+        @wraps(build)
+        async def keyboard(*args, **kwargs) -> str:
+            return payload(*args, **kwargs)
+
+        keyboard.cache_info = payload.cache_info
+        return keyboard
+
+    return decorator
@@ -1,7 +1,10 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+from app.keyboards.registry import static_keyboard
 
-async def choice_role_keyboard() -> ReplyKeyboardMarkup:
+
+@static_keyboard
+def choice_role_keyboard() -> ReplyKeyboardMarkup:
     """
     Отправляет клавиатуру выбора роли
 
@@ -16,7 +19,8 @@ async def choice_role_keyboard() -> ReplyKeyboardMarkup:
     return markup
 
 
-async def main_keyboard() -> ReplyKeyboardMarkup:
+@static_keyboard
+def main_keyboard() -> ReplyKeyboardMarkup:
     """
     Возвращает клавиатуру главного меню
 
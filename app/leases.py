@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from app.dependency import Connection
+from app.model import SubscriptionLease, SubscriptionWorker
+
+log = logging.getLogger(__name__)
+
+
+class PartitionLeases:
+    """
+    Аренда частей подписчиков для рассылки несколькими экземплярами бота
+
+    Подписчики делятся на partitions частей по id, каждую часть рассылает
+    только экземпляр, который ее арендует. Аренда продлевается каждые ttl / 3
+    секунд, части остановившегося экземпляра освобождаются по истечении ttl
+    и достаются другим. Экземпляры отмечаются в subscription_workers и делят
+    части поровну, лишние части освобождаются при появлении новых экземпляров.
+
+    Для каждой части хранится последняя разосланная минута, новый владелец
+    по ней досылает минуты, пропущенные во время передачи части
+    """
+
+    db: Connection
+    owner: str
+    partitions: int
+    ttl: int
+    owned: FrozenSet[int]
+    expires: float
+    # Количество живых экземпляров, включая этот
+    nodes: int
+    # Последняя разосланная минута арендованных частей, секунды unix time
+    sent: Dict[int, int]
+    # Вызываются после каждого продления с частями, полученными при нем
+    listeners: List[Callable[["PartitionLeases", FrozenSet[int]], None]]
+    _task: Optional[asyncio.Task]
+
+    def __init__(
+        self, db: Connection, partitions: int = 16, ttl: int = 30, owner: str = None
+    ) -> None:
+        self.db = db
+        self.owner = (
+            owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.partitions = partitions
+        self.ttl = ttl
+        self.owned = frozenset()
+        self.expires = 0
+        self.nodes = 1
+        self.sent = dict()
+        self.listeners = list()
+        self._task = None
+
+    def partition(self, id: int) -> int:
+        return id % self.partitions
+
+    def owns(self, id: int) -> bool:
+        """
+        Рассылает ли этот экземпляр пользователю
+
+        :param id: id пользователя
+        :return: False, если аренда не продлена вовремя
+        """
+
+        return self.partition(id) in self.owned and time.time() < self.expires
+
+    def take(self, minute: int) -> FrozenSet[int]:
+        """
+        Отмечает минуту разосланной и возвращает части, которые ее еще не рассылали
+
+        :param minute: секунды unix time
+        :return: пусто, если аренда не продлена вовремя
+        """
+
+        if time.time() >= self.expires:
+            return frozenset()
+        partitions = frozenset(
+            partition for partition in self.owned if self.sent[partition] < minute
+        )
+        for partition in partitions:
+            self.sent[partition] = minute
+        return partitions
+
+    async def record_sent(self, partitions: FrozenSet[int], minute: int) -> None:
+        """
+        Сохраняет разосланную минуту частей для следующего владельца
+
+        :param partitions:
+        :param minute: секунды unix time
+        :return:
+        """
+
+        try:
+            async with self.db() as conn:
+                await conn.execute(
+                    SubscriptionLease.mark_sent(self.owner, list(partitions), minute)
+                )
+        except Exception:
+            log.exception("Cause exception while recording sent minute %s", minute)
+
+    async def start(self) -> None:
+        """
+        Получает первые аренды и запускает их продление
+
+        :return:
+        """
+
+        async with self.db() as conn:
+            await conn.execute(SubscriptionLease.add_leases(self.partitions))
+        await self.renew()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Останавливает продление и освобождает аренды
+
+        :return:
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.owned = frozenset()
+        self.sent = dict()
+        async with self.db() as conn:
+            await conn.execute(SubscriptionLease.release(self.owner))
+            await conn.execute(SubscriptionWorker.remove(self.owner))
+
+    async def renew(self) -> None:
+        """
+        Продлевает аренды и выравнивает количество частей между экземплярами
+
+        :return:
+        """
+
+        now = int(time.time())
+        expires = now + self.ttl
+        async with self.db() as conn:
+            await conn.execute(SubscriptionWorker.heartbeat(self.owner, expires))
+            await conn.execute(SubscriptionWorker.remove(now=now - self.ttl))
+            await conn.execute(SubscriptionLease.renew(self.owner, expires))
+            owners = {
+                row.owner
+                for row in await (
+                    await conn.execute(SubscriptionWorker.live(now))
+                ).fetchall()
+            }
+            nodes = len(owners | {self.owner})
+            target = math.ceil(self.partitions / nodes)
+            owned = [
+                row.id
+                for row in await (
+                    await conn.execute(SubscriptionLease.owned(self.owner, now))
+                ).fetchall()
+            ]
+
+            if len(owned) > target:
+                await conn.execute(
+                    SubscriptionLease.release(self.owner, owned[target:])
+                )
+                owned = owned[:target]
+            elif len(owned) < target:
+                free = await (
+                    await conn.execute(SubscriptionLease.free(now))
+                ).fetchall()
+                for row in free:
+                    if len(owned) >= target:
+                        break
+                    result = await conn.execute(
+                        SubscriptionLease.claim(row.id, self.owner, now, expires)
+                    )
+                    if result.rowcount:
+                        owned.append(row.id)
+
+            claimed = frozenset(owned) - self.sent.keys()
+            if claimed:
+                sent = await (
+                    await conn.execute(SubscriptionLease.sent_minutes(list(claimed)))
+                ).fetchall()
+            else:
+                sent = list()
+
+        # Без записи о рассылке часть досылается только с текущей минуты
+        minute = now - now % 60 - 60
+        self.sent = {
+            partition: self.sent[partition]
+            for partition in owned
+            if partition in self.sent
+        }
+        for row in sent:
+            self.sent[row.id] = minute if row.sent is None else row.sent
+        if frozenset(owned) != self.owned:
+            log.info("Subscription partitions of %s: %s", self.owner, sorted(owned))
+        self.owned = frozenset(owned)
+        self.expires = expires
+        self.nodes = nodes
+        for listener in self.listeners:
+            try:
+                listener(self, claimed)
+            except Exception:
+                log.exception("Cause exception in subscription lease listener")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.renew()
+            except Exception:
+                log.exception("Cause exception while renewing subscription leases")
@@ -1,11 +1,17 @@
+import asyncio
 import logging
-from typing import NamedTuple
+import datetime
+from enum import Enum
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Integer, String, Column, Boolean, MetaData
+from sqlalchemy import Integer, SmallInteger, String, Column, Boolean, MetaData
 
 from app.dependency import Connection
+from app.utils.lru import LRUCache
 
 metadata = MetaData()
 db = declarative_base(metadata=metadata)
@@ -13,6 +19,81 @@ db = declarative_base(metadata=metadata)
 log = logging.getLogger(__name__)
 
 
+class SubscriptionDays(str, Enum):
+    """
+    Период расписания, который получает подписка
+    """
+
+    TODAY = "TODAY"
+    TOMORROW = "TOMORROW"
+    TODAY_AND_TOMORROW = "TODAY_AND_TOMORROW"
+    THIS_WEEK = "THIS_WEEK"
+    NEXT_WEEK = "NEXT_WEEK"
+
+
+class Menu(str, Enum):
+    """
+    Состояние диалога с пользователем
+    """
+
+    START = "START"
+    CHOICE_GROUP = "CHOICE_GROUP"
+    CHOICE_NAME = "CHOICE_NAME"
+    MAIN_MENU = "MAIN_MENU"
+    SEARCH_GROUP = "SEARCH_GROUP"
+    SEARCH_TEACHER = "SEARCH_TEACHER"
+    SEARCH_GROUP_DAY = "SEARCH_GROUP_DAY"
+    SEARCH_TEACHER_DAY = "SEARCH_TEACHER_DAY"
+    SUBSCRIBE_CHOICE_TIME = "SUBSCRIBE_CHOICE_TIME"
+
+
+class Period(NamedTuple):
+    """
+    Период расписания
+    """
+
+    # -1 - начало этой недели, -2 - начало следующей
+    start_day: int
+    days: int
+    # Текст, с которого начинается сообщение или подставляемый в него
+    text: str
+
+
+# Кнопки выбора периода подписки
+SUBSCRIPTION_DAYS = {
+    "Текущий день": SubscriptionDays.TODAY,
+    "Следующий день": SubscriptionDays.TOMORROW,
+    "Текущий и следующий день": SubscriptionDays.TODAY_AND_TOMORROW,
+    "Эта неделя": SubscriptionDays.THIS_WEEK,
+    "Следующая неделя": SubscriptionDays.NEXT_WEEK,
+}
+
+
+def time_to_minutes(time: str) -> int:
+    """
+    Переводит время 'h:mm' в количество минут от начала дня
+
+    :param time:
+    :return:
+    """
+
+    hours, minutes = time.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def minutes_to_time(minutes: int or None) -> str or None:
+    """
+    Переводит количество минут от начала дня во время 'hh:mm'
+
+    :param minutes:
+    :return:
+    """
+
+    if minutes is None:
+        return None
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
 class UserFilteredByTime(NamedTuple):
     id: int
     role: str
@@ -22,6 +103,25 @@ class UserFilteredByTime(NamedTuple):
     show_groups: bool
 
 
+class UserState(NamedTuple):
+    """
+    Данные пользователя, хранящиеся в кэше Model
+    """
+
+    id: int
+    login: str = None
+    role: str = None
+    menu: str = Menu.START
+    search_id: str = None
+    search_display: str = None
+    search_additional: str = None
+    subscription_time: int = None
+    subscription_days: str = None
+    subscription_id: str = None
+    show_location: bool = False
+    show_groups: bool = False
+
+
 class User(db):
     __tablename__ = "users"
     __table__: sa.sql.schema.Table
@@ -29,23 +129,32 @@ class User(db):
     id = Column(Integer, primary_key=True, index=True, unique=True)
     login = Column(String(256), default=None)
     role = Column(String(256), default=None)
-    menu = Column(String(256), default="START")
+    menu = Column(sa.Enum(*(menu.value for menu in Menu), name="menu"), default="START")
     search_id = Column(String(256), default=None)
     search_display = Column(String(256), default=None)
     search_additional = Column(String(256), default=None)
-    subscription_time = Column(String(256), default=None)
-    subscription_days = Column(String(256), default=None)
+    # Минуты от начала дня
+    subscription_time = Column(SmallInteger, default=None, index=True)
+    subscription_days = Column(
+        sa.Enum(*(days.value for days in SubscriptionDays), name="subscription_days"),
+        default=None,
+    )
     subscription_id = Column(String(256), default=None)
     show_location = Column(Boolean, default=False)
     show_groups = Column(Boolean, default=False)
+    # Время последнего изменения строки, обновляется базой
+    updated = Column(
+        sa.TIMESTAMP,
+        server_default=sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+        index=True,
+    )
 
     @classmethod
-    def filter_by_time(cls, time: str) -> sa.sql:
+    def subscribed_users(cls) -> sa.sql:
         """
-        Ищет всех пользователей с временем подписки time
+        Ищет всех пользователей с подпиской на расписание
 
-        :param time: время в формате 'hh:mm'
-        :return:
+        :return: поля UserFilteredByTime и время подписки
         """
 
         return sa.select(
@@ -56,8 +165,37 @@ class User(db):
                 cls.subscription_id,
                 cls.show_location,
                 cls.show_groups,
+                cls.subscription_time,
             ]
-        ).where(cls.subscription_time == time)
+        ).where(
+            sa.and_(
+                cls.subscription_time.isnot(None),
+                cls.subscription_days.isnot(None),
+                cls.subscription_id.isnot(None),
+            )
+        )
+
+    @classmethod
+    def changed_users(cls, since: datetime.datetime) -> sa.sql:
+        """
+        Ищет пользователей, измененных начиная с since
+
+        :param since: время базы
+        :return: поля UserFilteredByTime, время подписки и время изменения
+        """
+
+        return sa.select(
+            [
+                cls.id,
+                cls.role,
+                cls.subscription_days,
+                cls.subscription_id,
+                cls.show_location,
+                cls.show_groups,
+                cls.subscription_time,
+                cls.updated,
+            ]
+        ).where(cls.updated >= since)
 
     @classmethod
     def search_user(cls, id: int) -> sa.sql:
@@ -75,11 +213,17 @@ class User(db):
         """
         Добавляет нового пользователя
 
+        Если пользователь уже добавлен параллельным запросом, ничего не делает
+
         :param id:
         :return:
         """
 
-        return cls.__table__.insert().values([dict(id=id)])
+        return (
+            mysql.insert(cls.__table__)
+            .values(id=id)
+            .on_duplicate_key_update(id=cls.__table__.c.id)
+        )
 
     @classmethod
     def update_user(cls, id: int, data) -> sa.sql:
@@ -94,6 +238,20 @@ class User(db):
         sql = cls.__table__.update().values(data).where(cls.id == id)
         return sql
 
+    @classmethod
+    def update_users(cls, rows: list) -> sa.sql:
+        """
+        Обновляет одинаковый набор полей у нескольких пользователей одним запросом
+
+        :param rows: список словарей с id и обновляемыми полями
+        :return:
+        """
+
+        sql = mysql.insert(cls.__table__).values(rows)
+        return sql.on_duplicate_key_update(
+            {field: sql.inserted[field] for field in rows[0] if field != "id"}
+        )
+
     @classmethod
     def count_users(cls):
         """
@@ -106,38 +264,452 @@ class User(db):
         return sql
 
 
+class SubscriptionLease(db):
+    """
+    Аренда части подписчиков для рассылки, часть пользователя - id % количество
+    """
+
+    __tablename__ = "subscription_leases"
+    __table__: sa.sql.schema.Table
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    owner = Column(String(128), default=None)
+    # Время окончания аренды, секунды unix time
+    expires = Column(Integer, default=0, nullable=False)
+    # Последняя разосланная минута, секунды unix time
+    sent = Column(Integer, default=None)
+
+    @classmethod
+    def add_leases(cls, count: int) -> sa.sql:
+        """
+        Добавляет недостающие записи частей 0..count-1
+
+        :param count:
+        :return:
+        """
+
+        return (
+            mysql.insert(cls.__table__)
+            .values([dict(id=id, expires=0) for id in range(count)])
+            .prefix_with("IGNORE")
+        )
+
+    @classmethod
+    def renew(cls, owner: str, expires: int) -> sa.sql:
+        """
+        Продлевает все аренды владельца
+
+        :param owner:
+        :param expires:
+        :return:
+        """
+
+        return cls.__table__.update().values(expires=expires).where(cls.owner == owner)
+
+    @classmethod
+    def owned(cls, owner: str, now: int) -> sa.sql:
+        """
+        Части, которые арендует владелец
+
+        :param owner:
+        :param now:
+        :return:
+        """
+
+        return (
+            sa.select([cls.id])
+            .where(sa.and_(cls.owner == owner, cls.expires > now))
+            .order_by(cls.id)
+        )
+
+    @classmethod
+    def free(cls, now: int) -> sa.sql:
+        """
+        Свободные и просроченные части
+
+        :param now:
+        :return:
+        """
+
+        return (
+            sa.select([cls.id])
+            .where(sa.or_(cls.owner.is_(None), cls.expires <= now))
+            .order_by(cls.id)
+        )
+
+    @classmethod
+    def claim(cls, id: int, owner: str, now: int, expires: int) -> sa.sql:
+        """
+        Арендует часть, если она свободна или аренда просрочена
+
+        :param id:
+        :param owner:
+        :param now:
+        :param expires:
+        :return: изменится одна строка, если аренда получена
+        """
+
+        return (
+            cls.__table__.update()
+            .values(owner=owner, expires=expires)
+            .where(
+                sa.and_(cls.id == id, sa.or_(cls.owner.is_(None), cls.expires <= now))
+            )
+        )
+
+    @classmethod
+    def sent_minutes(cls, ids: list) -> sa.sql:
+        """
+        Последние разосланные минуты частей
+
+        :param ids:
+        :return:
+        """
+
+        return sa.select([cls.id, cls.sent]).where(cls.id.in_(ids))
+
+    @classmethod
+    def mark_sent(cls, owner: str, ids: list, minute: int) -> sa.sql:
+        """
+        Отмечает минуту разосланной для частей владельца
+
+        :param owner:
+        :param ids:
+        :param minute: секунды unix time
+        :return:
+        """
+
+        return (
+            cls.__table__.update()
+            .values(sent=minute)
+            .where(sa.and_(cls.owner == owner, cls.id.in_(ids)))
+        )
+
+    @classmethod
+    def release(cls, owner: str, ids: list = None) -> sa.sql:
+        """
+        Освобождает части владельца
+
+        :param owner:
+        :param ids: освобождаемые части, по умолчанию все
+        :return:
+        """
+
+        sql = (
+            cls.__table__.update()
+            .values(owner=None, expires=0)
+            .where(cls.owner == owner)
+        )
+        if ids is not None:
+            sql = sql.where(cls.id.in_(ids))
+        return sql
+
+
+class SubscriptionWorker(db):
+    """
+    Экземпляр бота, участвующий в рассылке, по его записям части делятся поровну
+    """
+
+    __tablename__ = "subscription_workers"
+    __table__: sa.sql.schema.Table
+
+    owner = Column(String(128), primary_key=True)
+    # Время, до которого экземпляр считается живым, секунды unix time
+    expires = Column(Integer, default=0, nullable=False)
+
+    @classmethod
+    def heartbeat(cls, owner: str, expires: int) -> sa.sql:
+        """
+        Отмечает экземпляр живым до expires
+
+        :param owner:
+        :param expires:
+        :return:
+        """
+
+        sql = mysql.insert(cls.__table__).values(owner=owner, expires=expires)
+        return sql.on_duplicate_key_update(expires=sql.inserted.expires)
+
+    @classmethod
+    def live(cls, now: int) -> sa.sql:
+        """
+        Живые экземпляры
+
+        :param now:
+        :return:
+        """
+
+        return sa.select([cls.owner]).where(cls.expires > now)
+
+    @classmethod
+    def remove(cls, owner: str = None, now: int = None) -> sa.sql:
+        """
+        Удаляет экземпляр или все экземпляры, не отмечавшиеся с now
+
+        :param owner:
+        :param now:
+        :return:
+        """
+
+        if owner is not None:
+            return cls.__table__.delete().where(cls.owner == owner)
+        return cls.__table__.delete().where(cls.expires <= now)
+
+
+class FSMRecord(db):
+    """
+    Состояние и данные aiogram FSM пользователя в чате
+    """
+
+    __tablename__ = "fsm_storage"
+    __table__: sa.sql.schema.Table
+
+    chat = Column(sa.BigInteger, primary_key=True, autoincrement=False)
+    user = Column(sa.BigInteger, primary_key=True, autoincrement=False)
+    state = Column(String(256), default=None)
+    # JSON
+    data = Column(sa.Text, default=None)
+    bucket = Column(sa.Text, default=None)
+
+    @classmethod
+    def get(cls, chat: int, user: int) -> sa.sql:
+        """
+        Ищет запись пользователя в чате
+
+        :param chat:
+        :param user:
+        :return:
+        """
+
+        return sa.select([cls.state, cls.data, cls.bucket]).where(
+            sa.and_(cls.chat == chat, cls.user == user)
+        )
+
+    @classmethod
+    def save(cls, chat: int, user: int, state: str, data: str, bucket: str) -> sa.sql:
+        """
+        Сохраняет запись пользователя в чате
+
+        :param chat:
+        :param user:
+        :param state:
+        :param data: JSON
+        :param bucket: JSON
+        :return:
+        """
+
+        sql = mysql.insert(cls.__table__).values(
+            chat=chat, user=user, state=state, data=data, bucket=bucket
+        )
+        return sql.on_duplicate_key_update(
+            state=sql.inserted.state,
+            data=sql.inserted.data,
+            bucket=sql.inserted.bucket,
+        )
+
+    @classmethod
+    def remove(cls, chat: int, user: int) -> sa.sql:
+        """
+        Удаляет запись пользователя в чате
+
+        :param chat:
+        :param user:
+        :return:
+        """
+
+        return cls.__table__.delete().where(sa.and_(cls.chat == chat, cls.user == user))
+
+
 class Model:
     db: Connection
+    cache: LRUCache
+    write_behind: bool
+    flush_interval: float
+    flush_size: int
+    _pending: Dict[int, dict]
+    # Изменения, которые записываются в базу текущим flush
+    _flushing: Dict[int, dict]
+    _flush_lock: asyncio.Lock
+    _flush_task: asyncio.Task or None
+    # Номер изменения пользователя, увеличивается при каждом update_user
+    _versions: Dict[int, int]
+    # Вызываются после update_user с (id, data, UserState или None)
+    listeners: List[Callable[[int, dict, "UserState"], None]]
+
+    def __init__(
+        self,
+        db: Connection,
+        cache_size: int = 10000,
+        cache_ttl: int = 600,
+        write_behind: bool = False,
+        flush_interval: float = 0.1,
+        flush_size: int = 100,
+    ):
+        """
+        :param db:
+        :param cache_size: максимальное количество пользователей в кэше
+        :param cache_ttl: время жизни пользователя в кэше, секунды
+        :param write_behind: копить изменения пользователей и записывать их пачками
+        :param flush_interval: период записи накопленных изменений, секунды
+        :param flush_size: количество пользователей, при котором запись идет сразу
+        """
 
-    def __init__(self, db: Connection):
         self.db = db
-
-    async def get_user(self, id: int) -> User:
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = dict()
+        self._flushing = dict()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._versions = dict()
+        self.listeners = list()
+
+    async def get_user(self, id: int) -> UserState:
         """
         Получает данные User, если его нет создает
 
+        Данные берутся из кэша, в базу запрос идет только при промахе
+
         :param id:
         :return:
         """
 
+        user = self.cache.get(id)
+        if user is not None:
+            return user
+
+        # Строка может быть прочитана до того, как flush, идущий во время
+        # чтения, запишет изменения, поэтому они применяются поверх строки
+        flushing = self._flushing
+        # Если пользователь изменился во время чтения, строка может быть
+        # прочитана до записи изменения и не должна попасть в кэш
+        version = self._versions.get(id, 0)
         async with self.db() as connection:
-            user = await (await connection.execute(User.search_user(id))).fetchone()
-            if user is None:
+            row = await (await connection.execute(User.search_user(id))).fetchone()
+            if row is None:
                 await connection.execute(User.add_user(id))
-                user = User(id=id)
-            return user
+                user = UserState(id=id)
+            else:
+                user = UserState(**{field: row[field] for field in UserState._fields})
+        for changes in (flushing, self._flushing, self._pending):
+            if id in changes:
+                user = user._replace(**changes[id])
+        if self._versions.get(id, 0) == version:
+            self.cache.set(id, user)
+        return user
 
     async def update_user(self, id: int, data: dict) -> None:
         """
         Обновляет данные пользователя поданные как словарь
 
+        Изменения записываются в кэш и в базу. В режиме write_behind
+        запись в базу откладывается до ближайшего flush
+
         :param id:
         :param data:
         :return:
         """
 
-        async with self.db() as connection:
-            await connection.execute(User.update_user(id, data=data))
+        self._versions[id] = self._versions.get(id, 0) + 1
+        if self.write_behind:
+            self._pending.setdefault(id, dict()).update(data)
+            if len(self._pending) >= self.flush_size:
+                asyncio.ensure_future(self._try_flush())
+            elif self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.ensure_future(self._flush_later())
+        else:
+            async with self.db() as connection:
+                await connection.execute(User.update_user(id, data=data))
+
+        user = self.cache.pop(id)
+        if user is not None:
+            user = user._replace(**data)
+            self.cache.set(id, user)
+        for listener in self.listeners:
+            listener(id, data, user)
+
+    def apply_update(self, id: int, data: dict, user: UserState or None) -> None:
+        """
+        Применяет изменение пользователя, сделанное в другом процессе
+
+        Пользователь убирается из кэша, слушатели получают изменение
+        так же, как после update_user
+
+        :param id:
+        :param data: измененные поля
+        :param user: данные пользователя после изменения, если они известны
+        :return:
+        """
+
+        self._versions[id] = self._versions.get(id, 0) + 1
+        self.cache.pop(id)
+        for listener in self.listeners:
+            listener(id, data, user)
+
+    async def _flush_later(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self._try_flush()
+
+    async def _try_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            # Ошибка уже залогирована, изменения будут записаны следующим flush
+            pass
+
+    async def flush(self) -> None:
+        """
+        Записывает накопленные изменения пользователей в базу
+
+        Пользователи с одинаковым набором измененных полей записываются
+        одним запросом. Если запись не удалась, изменения возвращаются в очередь
+
+        :return:
+        """
+
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, dict()
+        self._flushing = pending
+
+        batches = defaultdict(list)
+        for id, data in pending.items():
+            data = dict(data, id=id)
+            batches[tuple(sorted(data))].append(data)
+
+        try:
+            async with self.db() as connection:
+                for rows in batches.values():
+                    for i in range(0, len(rows), self.flush_size):
+                        await connection.execute(
+                            User.update_users(rows[i : i + self.flush_size])
+                        )
+        except Exception:
+            log.exception("Failed to flush %s users, will retry", len(pending))
+            for id, data in pending.items():
+                self._pending[id] = dict(data, **self._pending.get(id, dict()))
+            raise
+        finally:
+            self._flushing = dict()
+
+    async def close(self) -> None:
+        """
+        Записывает все накопленные изменения перед остановкой
+
+        :return:
+        """
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
 
     async def get_count_users(self) -> int:
         """
@@ -1,7 +1,16 @@
-from typing import NamedTuple, Any
+from sys import intern
+from functools import lru_cache
+from typing import NamedTuple, Any, Iterable, Tuple
 from datetime import datetime
 
-from marshmallow import fields, Schema, EXCLUDE, pre_load, post_load
+from marshmallow import (
+    fields,
+    Schema,
+    EXCLUDE,
+    ValidationError,
+    pre_load,
+    post_load,
+)
 
 
 class Group(NamedTuple):
@@ -22,6 +31,53 @@ class Teacher(NamedTuple):
     name: str
 
 
+class Lesson(NamedTuple):
+    """
+    Объект данных пары, хранится в кэше расписания
+    """
+
+    time_start: str
+    time_end: str
+    name: str
+    type: str
+    groups: Tuple[str, ...]
+    audience: str
+    location: str
+    teachers_name: str
+    date: str
+    note: str or None
+    url1: str
+    url1_description: str
+    url2: str
+    url2_description: str
+
+    @classmethod
+    def from_pair(cls, pair: dict) -> "Lesson":
+        """
+        Создает пару из разобранного словаря, повторяющиеся строки интернируются
+
+        :param pair:
+        :return:
+        """
+
+        return cls(
+            time_start=intern(pair["time_start"]),
+            time_end=intern(pair["time_end"]),
+            name=intern(pair["name"]),
+            type=intern(pair["type"]),
+            groups=tuple(sorted(intern(group) for group in pair["groups"])),
+            audience=pair["audience"],
+            location=intern(pair["location"]),
+            teachers_name=intern(pair["teachers_name"]),
+            date=intern(pair["date"]),
+            note=pair["note"],
+            url1=pair["url1"],
+            url1_description=pair["url1_description"],
+            url2=pair["url2"],
+            url2_description=pair["url2_description"],
+        )
+
+
 class Data:
     """
     Объект данных, полученных с портала
@@ -94,35 +150,120 @@ class Pair(Schema):
         unknown = EXCLUDE
 
 
+def merge_pairs(pairs: Iterable[dict]) -> dict:
+    """
+    Группирует пары по дням, объединяя параллельные пары
+
+    Параллельные пары одного дня и времени с одинаковым названием
+    объединяются в одну, индекс позволяет находить их за O(1)
+
+    :param pairs: разобранные пары
+    :return: {'dd.mm.yyyy': [Lesson, ...]}, пары каждого дня отсортированы по времени
+    """
+
+    res = dict()
+    index = dict()
+    for pair in pairs:
+        key = (pair["date"], pair["time_start"], pair["name"])
+        save_pair = index.get(key)
+        if save_pair is None:
+            index[key] = pair
+            res.setdefault(pair["date"], []).append(pair)
+        else:
+            save_pair["audience"] = f"{save_pair['audience']}, {pair['audience']}"
+            save_pair["groups"] = save_pair["groups"].union(pair["groups"])
+            save_pair[
+                "teachers_name"
+            ] = f"{save_pair['teachers_name']}, {pair['teachers_name']}"
+    return {
+        date: [
+            Lesson.from_pair(pair)
+            for pair in sorted(pairs, key=lambda x: x["time_start"])
+        ]
+        for date, pairs in res.items()
+    }
+
+
 class ScheduleSchema(Schema):
     pairs = fields.List(fields.Nested(Pair()))
 
     @post_load()
     def post_load(self, data, **kwargs):
-        res = dict()
-        for pairs in data["pairs"]:
-            for time_start, pair in pairs.items():
-                if pair["date"] in res:
-                    for save_pair in res[pair["date"]]:
-                        if (
-                            save_pair["time_start"] == pair["time_start"]
-                            and save_pair["name"] == pair["name"]
-                        ):
-                            save_pair[
-                                "audience"
-                            ] = f"{save_pair['audience']}, {pair['audience']}"
-                            save_pair["groups"] = save_pair["groups"].union(
-                                pair["groups"]
-                            )
-                            save_pair[
-                                "teachers_name"
-                            ] = f"{save_pair['teachers_name']}, {pair['teachers_name']}"
-                            break
-                    else:
-                        res[pair["date"]] = res[pair["date"]] + [pair]
-                else:
-                    res[pair["date"]] = [pair]
-        return {
-            date: sorted(pairs, key=lambda x: x["time_start"])
-            for date, pairs in res.items()
-        }
+        return merge_pairs(pair for pairs in data["pairs"] for pair in pairs.values())
+
+
+@lru_cache(maxsize=1024)
+def convert_date(value: str) -> str:
+    """
+    Переводит дату RUZ 'yyyy.mm.dd' в 'dd.mm.yyyy', как DateField
+
+    :param value:
+    :return:
+    """
+
+    return datetime.strptime(value, "%Y.%m.%d").strftime("%d.%m.%Y")
+
+
+def _string(value: Any, default: str = None) -> str or None:
+    """
+    Проверяет строковое значение так же, как поля схемы Pair
+
+    :param value:
+    :param default: значение для пустых полей, None - поле обязательное
+    :return:
+    """
+
+    if default is not None and not value:
+        return default
+    if not isinstance(value, str):
+        raise ValidationError("Not a valid string.")
+    return value
+
+
+def parse_pair(data: dict) -> dict:
+    """
+    Разбирает пару из ответа RUZ без marshmallow, результат совпадает с Pair
+
+    :param data: пара в формате RUZ
+    :return:
+    """
+
+    auditorium = data.get("auditorium")
+    note = data.get("note")
+    return {
+        "time_start": _string(data.get("beginLesson")),
+        "time_end": _string(data.get("endLesson")),
+        "name": _string(data.get("discipline"), "Без названия"),
+        "type": _string(data.get("kindOfWork"), ""),
+        "groups": set(
+            (data["group"] or data["stream"] or "").replace(" ", "").split(",")
+        ),
+        "audience": auditorium.replace("_", "-").split("/")[-1]
+        if auditorium
+        else "Без аудитории",
+        "location": _string(data.get("building"), ""),
+        "teachers_name": _string(data.get("lecturer"), "Преподователь не определен"),
+        "date": convert_date(data["date"]),
+        "note": note if note is None else _string(note),
+        "url1": _string(data.get("url1"), ""),
+        "url1_description": _string(data.get("url1_description"), ""),
+        "url2": _string(data.get("url2"), ""),
+        "url2_description": _string(data.get("url2_description"), ""),
+    }
+
+
+def parse_schedule(pairs: list) -> dict:
+    """
+    Быстрый разбор расписания RUZ, результат совпадает с ScheduleSchema
+
+    :param pairs: ответ RUZ
+    :return: {'dd.mm.yyyy': [Lesson, ...]}
+    :raises ValidationError: если ответ не соответствует формату
+    """
+
+    if not isinstance(pairs, list):
+        raise ValidationError("Not a valid list.")
+    try:
+        return merge_pairs(parse_pair(pair) for pair in pairs)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValidationError(str(e))
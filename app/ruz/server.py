@@ -1,26 +1,217 @@
 import ssl
 import certifi
 import datetime
+import asyncio
 import logging
 from asyncio import sleep
+from functools import wraps
+from typing import Awaitable, Callable, Dict, Hashable, Iterator, List
 from urllib.parse import quote
 
 import ujson
-from aiocache import cached
+from aiocache import cached, SimpleMemoryCache
 from aiocache.serializers import PickleSerializer
-from aiohttp import ClientSession, ClientError
+from aiohttp import ClientSession, ClientError, ClientTimeout, TCPConnector
 from aiogram.utils import markdown
+from aiogram.utils.parts import MAX_MESSAGE_LENGTH, safe_split_text
 from marshmallow import ValidationError
 
-from app.ruz.schemas import ScheduleSchema, Data, Group, Teacher
+from app.ruz.schemas import ScheduleSchema, Data, Group, Teacher, parse_schedule
+from app.utils.lru import LRUCache
 
 SCHEDULE_SCHEMA = ScheduleSchema()
 
+# 5 минут
+SCHEDULE_TTL = 300
+
+# Разобранное расписание по дням, ключи вида 'group:123:dd.mm.yyyy'
+schedule_cache = SimpleMemoryCache(serializer=PickleSerializer())
+
 log = logging.getLogger(__name__)
 
 ssl_context = ssl.create_default_context(cafile=certifi.where())
 
 
+class RuzClient:
+    """
+    Клиент портала RUZ с общим пулом keep-alive соединений
+    """
+
+    session: ClientSession
+    fast_parser: bool
+
+    def __init__(
+        self,
+        limit_per_host: int = 20,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: int = 60,
+        fast_parser: bool = True,
+        timeout: float = 10,
+    ) -> None:
+        """
+        :param limit_per_host:
+        :param dns_cache_ttl:
+        :param keepalive_timeout:
+        :param fast_parser:
+        :param timeout: время ожидания запроса по умолчанию, секунды
+        """
+
+        self.fast_parser = fast_parser
+        self.session = ClientSession(
+            connector=TCPConnector(
+                ssl=ssl_context,
+                limit_per_host=limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=dns_cache_ttl,
+                keepalive_timeout=keepalive_timeout,
+            ),
+            timeout=ClientTimeout(total=timeout),
+        )
+
+    async def get_json(self, url: str, timeout: float = None) -> any:
+        """
+        Выполняет GET запрос и возвращает разобранный JSON
+
+        :param url:
+        :param timeout: время ожидания, по умолчанию время ожидания сессии
+        :return:
+        """
+
+        async with self.session.get(
+            url, timeout=self.session.timeout if timeout is None else timeout
+        ) as response:
+            return await response.json(loads=ujson.loads)
+
+    def load_schedule(self, response_json: list) -> dict:
+        """
+        Разбирает ответ RUZ с расписанием выбранным парсером
+
+        :param response_json:
+        :return:
+        :raises ValidationError:
+        """
+
+        if self.fast_parser:
+            return parse_schedule(response_json)
+        return SCHEDULE_SCHEMA.load({"pairs": response_json})
+
+    async def close(self) -> None:
+        """
+        Закрывает сессию и все соединения пула
+
+        :return:
+        """
+
+        await self.session.close()
+
+
+_client: RuzClient = None
+
+
+def setup_client(client: RuzClient or None) -> None:
+    """
+    Устанавливает клиент, через который идут все запросы к RUZ
+
+    :param client:
+    :return:
+    """
+
+    global _client
+    _client = client
+
+
+def get_client() -> RuzClient:
+    """
+    Возвращает текущий клиент RUZ, создавая клиент по умолчанию при необходимости
+
+    :return:
+    """
+
+    if _client is None or _client.session.closed:
+        setup_client(RuzClient())
+    return _client
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один запрос
+
+    Пока вызов с ключом выполняется, остальные вызывающие с тем же ключом
+    ожидают его результат, не выполняя запрос повторно
+    """
+
+    name: str
+    calls: int
+    coalesced: int
+    _flights: Dict[Hashable, asyncio.Future]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = dict()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]) -> any:
+        """
+        Выполняет func или присоединяется к уже выполняемому вызову с ключом key
+
+        :param key:
+        :param func: функция, создающая корутину запроса
+        :return: результат func
+        """
+
+        future = self._flights.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(func())
+            self._flights[key] = future
+            future.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return dict(
+            calls=self.calls, coalesced=self.coalesced, in_flight=self.in_flight
+        )
+
+
+flights: Dict[str, SingleFlight] = dict()
+
+
+def single_flight(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Декоратор, объединяющий одновременные вызовы func с одинаковыми аргументами
+
+    :param func:
+    :return:
+    """
+
+    flight = flights[func.__name__] = SingleFlight(func.__name__)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        return await flight.do(key, lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+def single_flight_stats() -> dict:
+    """
+    Статистика объединенных запросов по функциям
+
+    :return:
+    """
+
+    return {name: flight.stats() for name, flight in flights.items()}
+
+
 def date_name(date: datetime) -> str:
     """
     Определяет день недели по дате
@@ -40,6 +231,7 @@ def date_name(date: datetime) -> str:
 
 
 # 1 час
+@single_flight
 @cached(ttl=3600, serializer=PickleSerializer())
 async def get_group(group_name: str) -> Data:
     """
@@ -49,12 +241,10 @@ async def get_group(group_name: str) -> Data:
     :return: id группы в Data
     """
 
+    url = f"https://ruz.fa.ru/api/search?term={quote(group_name)}&type=group"
     try:
-        async with ClientSession() as client:
-            url = f"https://ruz.fa.ru/api/search?term={quote(group_name)}&type=group"
-            request = await client.get(url, timeout=2, ssl=ssl_context,)
-            response_json = await request.json(loads=ujson.loads)
-    except (ClientError, TimeoutError):
+        response_json = await get_client().get_json(url, timeout=2)
+    except (ClientError, asyncio.TimeoutError):
         log.warning("Timeout error %s", url)
         return Data.error("Timeout error")
     if response_json:
@@ -68,6 +258,7 @@ async def get_group(group_name: str) -> Data:
 
 
 # 1 час
+@single_flight
 @cached(ttl=3600, serializer=PickleSerializer())
 async def get_teacher(teacher_name: str) -> Data:
     """
@@ -77,14 +268,10 @@ async def get_teacher(teacher_name: str) -> Data:
     :return: Data
     """
 
+    url = f"https://ruz.fa.ru/api/search?term={quote(teacher_name)}&type=lecturer"
     try:
-        async with ClientSession() as client:
-            url = (
-                f"https://ruz.fa.ru/api/search?term={quote(teacher_name)}&type=lecturer"
-            )
-            response = await client.get(url, timeout=2, ssl=ssl_context,)
-            response_json = await response.json(loads=ujson.loads)
-    except (ClientError, TimeoutError):
+        response_json = await get_client().get_json(url, timeout=2)
+    except (ClientError, asyncio.TimeoutError):
         log.warning("Timeout error %s", url)
         return Data.error("Timeout error")
     if response_json:
@@ -94,7 +281,8 @@ async def get_teacher(teacher_name: str) -> Data:
     return Data.error("Not found")
 
 
-async def get_schedule(
+@single_flight
+async def fetch_schedule(
     id: int, date_start: datetime = None, date_end: datetime = None, type: str = "group"
 ) -> Data:
     """
@@ -104,8 +292,7 @@ async def get_schedule(
     :param date_start:
     :param date_end:
     :param type: 'group' 'lecturer'
-    :return: {'dd.mm.yyyy': {'time_start': , 'time_end': , 'name': , 'type': , 'groups': , 'audience': , 'location': ,
-                             'teachers_name': }}
+    :return: {'dd.mm.yyyy': [Lesson, ...]}
     """
 
     if not date_start:
@@ -116,23 +303,106 @@ async def get_schedule(
         f"https://ruz.fa.ru/api/schedule/{type}/{id}?start={date_start.strftime('%Y.%m.%d')}"
         f"&finish={date_end.strftime('%Y.%m.%d')}&lng=1"
     )
+    client = get_client()
     try:
-        async with ClientSession() as client:
-            response = await client.get(url, ssl=ssl_context)
-            response_json = await response.json(loads=ujson.loads)
-    except (ClientError, TimeoutError):
+        response_json = await client.get_json(url)
+    except (ClientError, asyncio.TimeoutError):
         log.warning("Timeout error %s", url)
         return Data.error("Timeout error")
     try:
-        res = SCHEDULE_SCHEMA.load({"pairs": response_json})
+        res = client.load_schedule(response_json)
         return Data(res)
     except ValidationError as e:
-        log.warning("Validation error in get_schedule for %s %s - %r", type, id, e)
+        log.warning("Validation error in fetch_schedule for %s %s - %r", type, id, e)
         return Data.error("Validation error")
 
 
+def schedule_key(type: str, id: int, date: datetime.date) -> str:
+    """
+    Ключ кэша расписания на один день
+
+    :param type:
+    :param id:
+    :param date:
+    :return:
+    """
+
+    return f"{type}:{id}:{date.strftime('%d.%m.%Y')}"
+
+
+async def get_schedule(
+    id: int, date_start: datetime = None, date_end: datetime = None, type: str = "group"
+) -> Data:
+    """
+    Возвращает расписание за период, используя кэш расписания по дням
+
+    Недостающие в кэше дни запрашиваются у сервера одним запросом,
+    расширенным до целых недель, и сохраняются в кэш по отдельности
+
+    :param id:
+    :param date_start:
+    :param date_end:
+    :param type: 'group' 'lecturer'
+    :return: как у fetch_schedule
+    """
+
+    if not date_start:
+        date_start = datetime.datetime.today()
+    if not date_end:
+        date_end = datetime.datetime.today() + datetime.timedelta(days=1)
+
+    days = [
+        date_start.date() + datetime.timedelta(days=i)
+        for i in range((date_end.date() - date_start.date()).days + 1)
+    ]
+    cached_days = await schedule_cache.multi_get(
+        [schedule_key(type, id, day) for day in days]
+    )
+    missing = [day for day, pairs in zip(days, cached_days) if pairs is None]
+
+    if missing:
+        fetch_start = missing[0] - datetime.timedelta(days=missing[0].weekday())
+        fetch_end = missing[-1] + datetime.timedelta(days=6 - missing[-1].weekday())
+        schedule = await fetch_schedule(id, fetch_start, fetch_end, type=type)
+        if schedule.has_error:
+            return schedule
+
+        fetched_days = [
+            fetch_start + datetime.timedelta(days=i)
+            for i in range((fetch_end - fetch_start).days + 1)
+        ]
+        await schedule_cache.multi_set(
+            [
+                (
+                    schedule_key(type, id, day),
+                    schedule.data.get(day.strftime("%d.%m.%Y"), []),
+                )
+                for day in fetched_days
+            ],
+            ttl=SCHEDULE_TTL,
+        )
+        cached_days = [
+            schedule.data.get(day.strftime("%d.%m.%Y"), []) if pairs is None else pairs
+            for day, pairs in zip(days, cached_days)
+        ]
+
+    return Data(
+        {
+            day.strftime("%d.%m.%Y"): pairs
+            for day, pairs in zip(days, cached_days)
+            if pairs
+        }
+    )
+
+
 # 2 минуты
-@cached(ttl=120, serializer=PickleSerializer())
+RENDER_TTL = 120
+
+# Готовые сообщения расписания с учетом настроек отображения
+render_cache = LRUCache(maxsize=2048, ttl=RENDER_TTL)
+
+
+@single_flight
 async def format_schedule(
     id: int,
     type: str,
@@ -140,10 +410,12 @@ async def format_schedule(
     days: int = 1,
     show_groups: bool = False,
     show_location: bool = False,
-) -> str or None:
+) -> List[str] or None:
     """
     Форматирует расписание к виду который отправляет бот
 
+    Разобранное расписание берется из кэша по дням get_schedule,
+    готовые сообщения запоминаются отдельно для каждого набора настроек отображения
 
     :param id:
     :param type:
@@ -151,65 +423,142 @@ async def format_schedule(
     :param days: количество дней
     :param show_location:
     :param show_groups:
-    :return: строку расписания
+    :return: сообщения расписания не длиннее MAX_MESSAGE_LENGTH
     """
 
-    text = str()
     date_start = datetime.datetime.now() + datetime.timedelta(days=start_day)
     date_end = date_start + datetime.timedelta(days=days)
+    key = (
+        type,
+        str(id),
+        date_start.strftime("%d.%m.%Y"),
+        days,
+        bool(show_groups),
+        bool(show_location),
+    )
+    messages = render_cache.get(key)
+    if messages is not None:
+        return messages
+
     schedule = await get_schedule(
         id, date_start, date_end, type="lecturer" if type == "teacher" else "group"
     )
     if schedule.has_error:
         return None
-    else:
-        schedule = schedule.data
-    date = datetime.datetime.today()
-    date += datetime.timedelta(days=start_day)
+    messages = list(
+        render_schedule(
+            schedule.data,
+            date_start=date_start,
+            days=days,
+            show_groups=show_groups,
+            show_location=show_location,
+        )
+    )
+    render_cache.set(key, messages)
+    return messages
+
+
+def render_schedule(
+    schedule: dict,
+    date_start: datetime,
+    days: int = 1,
+    show_groups: bool = False,
+    show_location: bool = False,
+    length: int = MAX_MESSAGE_LENGTH,
+) -> Iterator[str]:
+    """
+    Формирует сообщения расписания из разобранного расписания
+
+    Дни собираются в сообщение, пока оно помещается в length символов,
+    и сообщение отдается, как только следующий день в него не помещается.
+    День длиннее length делится safe_split_text
+
+    :param schedule: расписание в формате get_schedule
+    :param date_start: первый день
+    :param days: количество дней
+    :param show_groups:
+    :param show_location:
+    :param length: максимальная длина сообщения
+    :return: сообщения расписания
+    """
+
+    message = list()
+    message_length = 0
+    date = date_start
     for _ in range(days):
-        text_date = date.strftime("%d.%m.%Y")
-        text += f"📅 {date_name(date)}, {text_date}\n"
-        if text_date in schedule:
-            selected_days = set()
-            for lesson in sorted(schedule[text_date], key=lambda x: x["time_start"]):
-                if lesson["time_start"] in selected_days:
-                    text += "\n"
-                else:
-                    text += f"\n⏱{lesson['time_start']} – {lesson['time_end']}⏱\n"
-                    selected_days.add(lesson["time_start"])
-                text += f"*{lesson['name']}*\n"
-                if lesson["type"]:
-                    text += f"{lesson['type']}\n"
-                if show_groups and lesson["groups"]:
-                    if lesson["groups"]:
-                        text += "Группы: "
-                        text += f"{', '.join(lesson['groups'])}\n"
-                if lesson["audience"]:
-                    text += f"Где: {lesson['audience']}"
-                if show_location and lesson["location"] is not None:
-                    text += f", _{lesson['location']}_\n"
-                else:
-                    text += "\n"
-                text += f"Кто: {lesson['teachers_name']}\n"
-                if lesson["note"]:
-                    text += f'Примечание: {lesson["note"]}\n'
-                if lesson["url1"] or lesson["url2"]:
-                    if lesson["url1"] and lesson["url1_description"]:
-                        text += markdown.link(
-                            lesson["url1_description"], lesson["url1"]
-                        )
-                    if lesson["url1"] and lesson["url2"]:
-                        text += " • "
-                    else:
-                        text += "\n"
-                    if lesson["url2"] and lesson["url2_description"]:
-                        text += markdown.link(
-                            lesson["url2_description"], lesson["url2"]
-                        )
-                        text += "\n"
+        day = render_day(
+            schedule.get(date.strftime("%d.%m.%Y")),
+            date,
+            show_groups=show_groups,
+            show_location=show_location,
+        )
+        date += datetime.timedelta(days=1)
+
+        if message and message_length + len(day) > length:
+            yield "".join(message)
+            message = list()
+            message_length = 0
+        if len(day) > length:
+            yield from safe_split_text(day, length)
+            continue
+        message.append(day)
+        message_length += len(day)
+
+    if message:
+        yield "".join(message)
+
+
+def render_day(
+    lessons: list or None,
+    date: datetime,
+    show_groups: bool = False,
+    show_location: bool = False,
+) -> str:
+    """
+    Формирует текст расписания на один день
 
+    :param lessons: пары дня, None - пар нет
+    :param date:
+    :param show_groups:
+    :param show_location:
+    :return: текст дня, заканчивающийся пустой строкой
+    """
+
+    text = [f"📅 {date_name(date)}, {date.strftime('%d.%m.%Y')}\n"]
+    if lessons is None:
+        text.append("Нет пар\n\n")
+        return "".join(text)
+
+    selected_days = set()
+    for lesson in lessons:
+        if lesson.time_start in selected_days:
+            text.append("\n")
         else:
-            text += f"Нет пар\n"
-        text += "\n"
-        date += datetime.timedelta(days=1)
-    return text
+            text.append(f"\n⏱{lesson.time_start} – {lesson.time_end}⏱\n")
+            selected_days.add(lesson.time_start)
+        text.append(f"*{lesson.name}*\n")
+        if lesson.type:
+            text.append(f"{lesson.type}\n")
+        if show_groups and lesson.groups:
+            text.append(f"Группы: {', '.join(lesson.groups)}\n")
+        if lesson.audience:
+            text.append(f"Где: {lesson.audience}")
+        if show_location and lesson.location is not None:
+            text.append(f", _{lesson.location}_\n")
+        else:
+            text.append("\n")
+        text.append(f"Кто: {lesson.teachers_name}\n")
+        if lesson.note:
+            text.append(f"Примечание: {lesson.note}\n")
+        if lesson.url1 or lesson.url2:
+            if lesson.url1 and lesson.url1_description:
+                text.append(markdown.link(lesson.url1_description, lesson.url1))
+            if lesson.url1 and lesson.url2:
+                text.append(" • ")
+            else:
+                text.append("\n")
+            if lesson.url2 and lesson.url2_description:
+                text.append(markdown.link(lesson.url2_description, lesson.url2))
+                text.append("\n")
+    text.append("\n")
+    return "".join(text)
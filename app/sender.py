@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Set
+
+from aiogram import Bot
+from aiogram.utils import exceptions
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, не более capacity подряд
+
+    Емкость не меньше одного токена, иначе при rate < 1 токен никогда
+    не накопится
+    """
+
+    rate: float
+    capacity: float
+    tokens: float
+    updated: float
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float) -> None:
+        """
+        Меняет частоту, накопленные токены сохраняются в пределах новой емкости
+
+        :param rate:
+        :return:
+        """
+
+        self._refill()
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def delay(self) -> float:
+        """
+        Время в секундах до появления свободного токена
+
+        :return:
+        """
+
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        """
+        Забирает токен, не дожидаясь его появления
+
+        :return:
+        """
+
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        """
+        Дожидается свободного токена и забирает его
+
+        :return:
+        """
+
+        delay = self.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay()
+        self.consume()
+
+
+class Job(NamedTuple):
+    kwargs: dict
+    future: asyncio.Future
+    # Сообщение рассылки, уступает очередь ответам пользователям
+    background: bool
+
+
+class MessageSender:
+    """
+    Очередь исходящих сообщений с учетом ограничений Telegram
+
+    Общий поток отправки ограничен rate сообщениями в секунду, каждый чат
+    chat_rate сообщениями в секунду. Сообщения одного чата уходят по порядку,
+    при RetryAfter сообщение отправляется повторно через указанное сервером время.
+    Чаты с ответами пользователям отправляются раньше чатов с рассылкой
+    """
+
+    bot: Bot
+    # Ограничение частоты всего процесса, сообщений в секунду
+    limit: float
+    max_retries: int
+    _bucket: TokenBucket
+    _chat_rate: float
+    _chat_buckets: Dict[int, TokenBucket]
+    _chats: Dict[int, Deque[Job]]
+    _ready: Deque[int]
+    _background: Deque[int]
+    _wakeup: asyncio.Event
+    _pending: Set[asyncio.Future]
+    _task: Optional[asyncio.Task]
+
+    def __init__(
+        self, bot: Bot, rate: float = 30, chat_rate: float = 1, max_retries: int = 5
+    ) -> None:
+        self.bot = bot
+        self.limit = rate
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, capacity=max(rate, 1))
+        self._chat_rate = chat_rate
+        self._chat_buckets = dict()
+        self._chats = dict()
+        self._ready = deque()
+        self._background = deque()
+        self._wakeup = asyncio.Event()
+        self._pending = set()
+        self._task = None
+
+    @property
+    def queue_size(self) -> int:
+        """
+        Количество сообщений, ожидающих отправки
+
+        :return:
+        """
+
+        return sum(len(jobs) for jobs in self._chats.values())
+
+    def share(self, parts: int) -> None:
+        """
+        Делит ограничение частоты между экземплярами бота с одним токеном
+
+        :param parts: количество экземпляров
+        :return:
+        """
+
+        rate = self.limit / max(parts, 1)
+        if rate != self._bucket.rate:
+            log.info("Send rate limit is %.2f messages per second", rate)
+            self._bucket.set_rate(rate)
+
+    def start(self) -> None:
+        """
+        Запускает цикл отправки
+
+        :return:
+        """
+
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Дожидается отправки очереди и останавливает цикл отправки
+
+        :param timeout: максимальное время ожидания очереди
+        :return:
+        """
+
+        if self._pending:
+            await asyncio.wait(set(self._pending), timeout=timeout)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def send_message(
+        self, chat_id: int, background: bool = False, **kwargs
+    ) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь
+
+        :param chat_id:
+        :param background: сообщение рассылки, отправляется после ответов
+        :param kwargs: параметры Bot.send_message
+        :return: future с результатом Bot.send_message
+        """
+
+        future = asyncio.get_event_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+        job = Job(
+            kwargs=dict(kwargs, chat_id=chat_id), future=future, background=background
+        )
+        if chat_id in self._chats:
+            self._chats[chat_id].append(job)
+        else:
+            self._chats[chat_id] = deque([job])
+            self._schedule(chat_id)
+        return future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate)
+        return bucket
+
+    def _schedule(self, chat_id: int) -> None:
+        """
+        Помечает чат готовым к отправке, когда у него появится токен
+
+        :param chat_id:
+        :return:
+        """
+
+        queue = self._background if self._chats[chat_id][0].background else self._ready
+        delay = self._chat_bucket(chat_id).delay()
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self._push, queue, chat_id)
+        else:
+            self._push(queue, chat_id)
+
+    def _push(self, queue: Deque[int], chat_id: int) -> None:
+        queue.append(chat_id)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            while not self._ready and not self._background:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # Очередь выбирается после ожидания токена, чтобы ответ,
+            # пришедший за это время, ушел раньше рассылки
+            await self._bucket.acquire()
+            chat_id = (self._ready or self._background).popleft()
+            self._chat_bucket(chat_id).consume()
+            asyncio.get_event_loop().create_task(self._send(chat_id))
+
+    async def _send(self, chat_id: int, retry: int = 0) -> None:
+        job = self._chats[chat_id][0]
+        retrying = False
+        try:
+            # Если вызывающий перестал ждать, сообщение больше не нужно
+            if not job.future.done():
+                self._resolve(job, result=await self.bot.send_message(**job.kwargs))
+        except exceptions.RetryAfter as e:
+            if retry < self.max_retries:
+                log.warning(
+                    "Target [CHAT_ID:%s]: Flood limit is exceeded. Retry in %s seconds.",
+                    chat_id,
+                    e.timeout,
+                )
+                asyncio.get_event_loop().call_later(
+                    e.timeout, self._retry, chat_id, retry + 1
+                )
+                retrying = True
+            else:
+                self._resolve(job, exception=e)
+        except Exception as e:
+            self._resolve(job, exception=e)
+        finally:
+            if not retrying:
+                self._done(chat_id)
+
+    @staticmethod
+    def _resolve(job: Job, result=None, exception: Exception = None) -> None:
+        """
+        Передает результат отправки, если вызывающий еще ждет его
+
+        :param job:
+        :param result:
+        :param exception:
+        :return:
+        """
+
+        if job.future.done():
+            return
+        if exception is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(exception)
+
+    def _done(self, chat_id: int) -> None:
+        """
+        Убирает отправленное сообщение и планирует следующее сообщение чата
+
+        :param chat_id:
+        :return:
+        """
+
+        jobs = self._chats[chat_id]
+        jobs.popleft()
+        if jobs:
+            self._schedule(chat_id)
+        else:
+            del self._chats[chat_id]
+            asyncio.get_event_loop().call_later(
+                2 / self._chat_rate, self._forget, chat_id
+            )
+
+    def _forget(self, chat_id: int) -> None:
+        """
+        Удаляет ограничитель чата, если у чата нет сообщений в очереди
+
+        :param chat_id:
+        :return:
+        """
+
+        bucket = self._chat_buckets.get(chat_id)
+        if chat_id not in self._chats and bucket is not None and bucket.is_full:
+            del self._chat_buckets[chat_id]
+
+    def _retry(self, chat_id: int, retry: int) -> None:
+        async def send():
+            await self._bucket.acquire()
+            self._chat_bucket(chat_id).consume()
+            await self._send(chat_id, retry)
+
+        asyncio.get_event_loop().create_task(send())
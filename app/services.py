@@ -1,11 +1,13 @@
 import asyncio
+import hmac
 import logging
-import time
-from asyncio import Event, sleep
+import datetime
+from asyncio import Event
+from collections import defaultdict
+from multiprocessing.connection import Connection as Pipe
 
-import schedule
 import aiohttp.web
-from aiogram import Bot
+from aiogram import Bot, Dispatcher, types
 from aiogram.types import ParseMode
 from aiomisc.service.base import Service
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
@@ -15,16 +17,49 @@ from aiohttp.web import Response
 
 from app.dispatcher import BotDispatcher
 from app.dependency import Connection
-from app.model import Model, User, UserFilteredByTime
+from app.model import Model, UserFilteredByTime, SubscriptionDays, Period
+from app.subscriptions import SubscriptionIndex
+from app.leases import PartitionLeases
+from app.storage import SQLStorage
+from app.ruz.server import RuzClient, single_flight_stats
+from app.sender import MessageSender
+from app.webhook import UpdateQueue, SECRET_HEADER
+from app.workers import ShardedUpdates, receive_updates, send_user_updates
 
 log = logging.getLogger(__name__)
 
+# Расписание, которое получает подписка
+SUBSCRIPTION_PERIODS = {
+    SubscriptionDays.TODAY: Period(0, 1, "Ваше расписание на сегодня\n\n"),
+    SubscriptionDays.TOMORROW: Period(1, 1, "Ваше расписание на завтра\n\n"),
+    SubscriptionDays.TODAY_AND_TOMORROW: Period(
+        0, 2, "Ваше расписание на сегодня и завтра\n\n"
+    ),
+    SubscriptionDays.THIS_WEEK: Period(-1, 7, "Ваше расписание на 7 дней\n\n"),
+    SubscriptionDays.NEXT_WEEK: Period(
+        -2, 7, "Ваше расписание на следующую неделю\n\n"
+    ),
+}
+
 
 class BotService(Service):
-    __dependencies__ = ("db", "bot")
+    __dependencies__ = ("bot", "model", "ruz", "sender", "updates", "storage")
     bot: Bot
-    db: Connection
+    model: Model
+    ruz: RuzClient
+    sender: MessageSender
+    storage: SQLStorage
+    updates: UpdateQueue
     dispatcher: BotDispatcher
+    # Получать обновления через webhook вместо long polling
+    webhook: bool = False
+    webhook_url: str = None
+    webhook_secret: str = None
+    # Канал, по которому процесс-обработчик получает обновления
+    connection: Pipe = None
+    # Канал, по которому процесс-обработчик отправляет изменения подписок
+    events: Pipe = None
+    _task: asyncio.Task = None
 
     async def start(self):
         """
@@ -33,12 +68,69 @@ class BotService(Service):
         :return:
         """
 
-        self.dispatcher = BotDispatcher(bot=self.bot, db=self.db)
+        self.dispatcher = BotDispatcher(
+            bot=self.bot, model=self.model, sender=self.sender, storage=self.storage
+        )
         self.dispatcher.middleware.setup(LoggingMiddleware())
 
-        asyncio.run_coroutine_threadsafe(self.dispatcher.start_polling(), self.loop)
+        if self.polling:
+            asyncio.run_coroutine_threadsafe(self.dispatcher.start_polling(), self.loop)
+            log.info("Bot started")
+            return
+
+        # Обработчики очереди наследуют контекст с текущими ботом и диспетчером
+        Dispatcher.set_current(self.dispatcher)
+        Bot.set_current(self.bot)
+        self.updates.start(self.dispatcher.process_update)
+
+        if self.connection is not None:
+            if self.events is not None:
+                self.model.listeners.append(send_user_updates(self.events))
+            self._task = self.loop.create_task(
+                receive_updates(self.connection, self.updates, self.sender)
+            )
+            log.info("Bot worker started")
+        elif self.webhook:
+            await self.bot.set_webhook(
+                self.webhook_url, secret_token=self.webhook_secret
+            )
+            log.info("Bot started with webhook %s", self.webhook_url)
+        else:
+            self._task = self.loop.create_task(self.forward_polling())
+            log.info("Bot started with %s workers", self.updates.workers)
+
+    @property
+    def polling(self) -> bool:
+        """
+        Получает и обрабатывает обновления сам, без очереди
+
+        :return:
+        """
+
+        return (
+            not self.webhook
+            and self.connection is None
+            and not isinstance(self.updates, ShardedUpdates)
+        )
+
+    async def forward_polling(self):
+        """
+        Получает обновления через long polling и передает их в очередь
+
+        :return:
+        """
 
-        log.info("Bot started")
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=20)
+            except Exception:
+                log.exception("Cause exception while getting updates")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.updates.put_wait(update)
+                offset = update.update_id + 1
 
     async def stop(self, exception=None):
         """
@@ -48,15 +140,51 @@ class BotService(Service):
         :return:
         """
 
-        await self.dispatcher.stop_polling()
+        if self._task is not None:
+            self._task.cancel()
+        if self.polling:
+            await self.dispatcher.stop_polling()
+        else:
+            await self.updates.close()
+        await self.model.flush()
 
 
 class BotSubscriptionService(Service):
-    __dependencies__ = ("db", "bot")
+    __dependencies__ = (
+        "db",
+        "bot",
+        "model",
+        "ruz",
+        "sender",
+        "subscriptions",
+        "leases",
+        "storage",
+        "updates",
+    )
     bot: Bot
     db: Connection
+    model: Model
+    ruz: RuzClient
+    sender: MessageSender
+    storage: SQLStorage
+    subscriptions: SubscriptionIndex
+    leases: PartitionLeases
+    updates: UpdateQueue
     dispatcher: BotDispatcher
     exit_event: Event
+    # За сколько минут до рассылки прогревать кэш расписания,
+    # должно быть меньше времени жизни кэша format_schedule
+    prefetch_minutes: int = 1
+    # Как часто сверять индекс подписчиков с базой, минуты
+    reconcile_minutes: int = 10
+    # Как часто забирать из базы изменения подписок других экземпляров, секунды
+    refresh_seconds: int = 30
+    # За сколько последних минут выполнять пропущенные рассылки
+    catch_up_minutes: int = 5
+    # Отставание срабатывания таймера от запланированного времени, секунды
+    last_lag: float = 0
+    max_lag: float = 0
+    _refresh_task: asyncio.Task = None
 
     async def start(self):
         """
@@ -65,22 +193,134 @@ class BotSubscriptionService(Service):
         :return:
         """
 
-        self.dispatcher = BotDispatcher(bot=self.bot, db=self.db)
+        self.dispatcher = BotDispatcher(
+            bot=self.bot, model=self.model, sender=self.sender, storage=self.storage
+        )
         self.dispatcher.middleware.setup(LoggingMiddleware())
         self.exit_event = Event()
 
-        logging.getLogger("schedule").setLevel(logging.DEBUG)
+        self.leases.listeners.append(self.on_leases_renewed)
+        # Первые аренды получены при создании зависимости
+        self.on_leases_renewed(self.leases, self.leases.owned)
+        self._refresh_task = self.loop.create_task(self.refresh_subscriptions())
 
-        def distribution():
-            asyncio.run_coroutine_threadsafe(self.schedule_distribution(), self.loop)
+        log.info("Bot subscription started")
 
-        schedule.every().minute.at(":00").do(distribution)
+        await self.run_timer()
 
-        log.info("Bot subscription started")
+    async def run_timer(self):
+        """
+        Таймер рассылки
+
+        Спит до ближайшей минуты, на которую есть работа: рассылка, прогрев кэша
+        или сверка индекса. Минуты, пропущенные из-за задержек, выполняются
+        при следующем пробуждении
+
+        :return:
+        """
 
+        last = self._minute(datetime.datetime.now())
         while not self.exit_event.is_set():
-            schedule.run_pending()
-            await sleep(1)
+            target = self._next_minute(last)
+            delay = (target - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                self.subscriptions.changed.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wait_wakeup(), timeout=min(delay, 60 * 60)
+                    )
+                    # Индекс или флаг остановки изменились, пересчитываем цель
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+            now = datetime.datetime.now()
+            current = self._minute(now)
+            minute = max(
+                last + datetime.timedelta(minutes=1),
+                current - datetime.timedelta(minutes=self.catch_up_minutes - 1),
+            )
+            # Минуты без работы до target пропускаются при обычном сне, warning
+            # нужен, только если рассылка target не попала в окно догоняния
+            if minute > target:
+                log.warning("Timer skipped minutes from %s to %s", target, minute)
+            while minute <= current:
+                self._fire(minute, now)
+                minute += datetime.timedelta(minutes=1)
+            last = max(last, current)
+
+    async def _wait_wakeup(self):
+        """
+        Ждет изменения индекса подписчиков или остановки сервиса
+
+        :return:
+        """
+
+        waiters = [
+            asyncio.ensure_future(self.subscriptions.changed.wait()),
+            asyncio.ensure_future(self.exit_event.wait()),
+        ]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    @staticmethod
+    def _minute(time: datetime.datetime) -> datetime.datetime:
+        return time.replace(second=0, microsecond=0)
+
+    def _has_work(self, minute: datetime.datetime, minutes: set) -> bool:
+        """
+        Есть ли на минуту рассылка, прогрев кэша или сверка индекса
+
+        :param minute:
+        :param minutes: минуты дня, на которые есть подписчики
+        :return:
+        """
+
+        prefetch = minute + datetime.timedelta(minutes=self.prefetch_minutes)
+        return (
+            minute.hour * 60 + minute.minute in minutes
+            or prefetch.hour * 60 + prefetch.minute in minutes
+            or (minute.hour * 60 + minute.minute) % self.reconcile_minutes == 0
+        )
+
+    def _next_minute(self, last: datetime.datetime) -> datetime.datetime:
+        """
+        Ближайшая после last минута, на которую есть работа
+
+        :param last:
+        :return:
+        """
+
+        minutes = self.subscriptions.minutes()
+        minute = last + datetime.timedelta(minutes=1)
+        while not self._has_work(minute, minutes):
+            minute += datetime.timedelta(minutes=1)
+        return minute
+
+    def _fire(self, minute: datetime.datetime, now: datetime.datetime) -> None:
+        """
+        Запускает работу, запланированную на минуту
+
+        :param minute:
+        :param now: фактическое время срабатывания
+        :return:
+        """
+
+        self.last_lag = (now - minute).total_seconds()
+        self.max_lag = max(self.max_lag, self.last_lag)
+        log.debug("Timer fired for %s, lag %.3f s", minute, self.last_lag)
+
+        minutes = self.subscriptions.minutes()
+        prefetch = minute + datetime.timedelta(minutes=self.prefetch_minutes)
+        if minute.hour * 60 + minute.minute in minutes:
+            self.loop.create_task(self.schedule_distribution(minute))
+        if prefetch.hour * 60 + prefetch.minute in minutes:
+            self.loop.create_task(self.schedule_prefetch(minute))
+        if (minute.hour * 60 + minute.minute) % self.reconcile_minutes == 0:
+            self.loop.create_task(self.reconcile_subscriptions())
 
     async def stop(self, exception=None):
         """
@@ -91,121 +331,189 @@ class BotSubscriptionService(Service):
         """
 
         self.exit_event.set()
+        self.leases.listeners.remove(self.on_leases_renewed)
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        await self.model.flush()
+
+    def on_leases_renewed(self, leases: PartitionLeases, claimed: frozenset) -> None:
+        """
+        Делит ограничение отправки между экземплярами и досылает минуты,
+        пропущенные прошлыми владельцами полученных частей
+
+        :param leases:
+        :param claimed: части, полученные при продлении
+        :return:
+        """
+
+        self.sender.share(leases.nodes)
+        if isinstance(self.updates, ShardedUpdates):
+            self.updates.share_send_rate(leases.nodes)
+        if claimed:
+            self.loop.create_task(self.catch_up_distribution())
+
+    async def catch_up_distribution(self):
+        """
+        Рассылает последние catch_up_minutes минут частям, которые их не рассылали
+
+        :return:
+        """
+
+        current = self._minute(datetime.datetime.now())
+        minutes = self.subscriptions.minutes()
+        for i in reversed(range(self.catch_up_minutes)):
+            minute = current - datetime.timedelta(minutes=i)
+            if minute.hour * 60 + minute.minute in minutes:
+                await self.schedule_distribution(minute)
+
+    async def refresh_subscriptions(self):
+        """
+        Периодически применяет к индексу изменения подписок из базы
 
-    async def schedule_distribution(self):
+        :return:
+        """
+
+        while not self.exit_event.is_set():
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.subscriptions.refresh()
+            except Exception:
+                log.exception("Cause exception while refreshing subscriptions")
+
+    async def schedule_distribution(self, time: datetime.datetime = None):
         """
         Рассылает расписание пользователям
 
+        Пользователи с одинаковыми параметрами подписки группируются,
+        расписание для каждой группы запрашивается и форматируется один раз.
+        Рассылка идет только пользователям арендованных частей, которые
+        еще не рассылали эту минуту
+
+        :param time: минута рассылки, по умолчанию текущая
         :return:
         """
 
-        async with self.db() as conn:
-            for user in (
-                UserFilteredByTime(*user.as_tuple())
-                for user in await (
+        if time is None:
+            time = datetime.datetime.now()
+        minute = int(self._minute(time).timestamp())
+        partitions = self.leases.take(minute)
+        if not partitions:
+            return
+        await self.leases.record_sent(partitions, minute)
+        users = [
+            user
+            for user in self.subscriptions.get(time.hour * 60 + time.minute)
+            if self.leases.partition(user.id) in partitions
+        ]
+
+        subscriptions = defaultdict(list)
+        for user in users:
+            if all(
+                item is not None
+                for item in (user.subscription_days, user.subscription_id,)
+            ):
+                subscriptions[
                     (
-                        await conn.execute(
-                            User.filter_by_time(
-                                time.strftime("%H:%M", time.localtime())
-                            )
-                        )
-                    ).fetchall()
+                        user.subscription_id,
+                        user.role,
+                        user.subscription_days,
+                        bool(user.show_groups),
+                        bool(user.show_location),
+                    )
+                ].append(user)
+
+        schedules = await asyncio.gather(
+            *(self.subscription_schedule(users[0]) for users in subscriptions.values()),
+            return_exceptions=True,
+        )
+
+        for key, users, text in zip(subscriptions, subscriptions.values(), schedules):
+            # Ошибка одной группы не должна отменять рассылку остальным
+            if isinstance(text, BaseException):
+                log.error(
+                    "Cause exception while distributing schedule %s to %s users",
+                    key,
+                    len(users),
+                    exc_info=text,
                 )
-            ):
-                if all(
-                    item is not None
-                    for item in (user.subscription_days, user.subscription_id,)
-                ):
-                    if user.subscription_days == "Текущий день":
-                        self.loop.create_task(
-                            self.dispatcher.send_message(
-                                chat_id=user.id,
-                                text=await self.dispatcher.get_schedule(
-                                    user=user,
-                                    start_day=0,
-                                    days=1,
-                                    search_id=int(user.subscription_id),
-                                    search_type=user.role,
-                                    show_location=user.show_location,
-                                    show_groups=user.show_groups,
-                                    text="Ваше расписание на сегодня\n\n",
-                                ),
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                        )
-                    elif user.subscription_days == "Следующий день":
-                        self.loop.create_task(
-                            self.dispatcher.send_message(
-                                chat_id=user.id,
-                                text=await self.dispatcher.get_schedule(
-                                    user=user,
-                                    start_day=1,
-                                    days=1,
-                                    search_id=int(user.subscription_id),
-                                    search_type=user.role,
-                                    show_location=user.show_location,
-                                    show_groups=user.show_groups,
-                                    text="Ваше расписание на завтра\n\n",
-                                ),
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                        )
-                    elif user.subscription_days == "Текущий и следующий день":
-                        self.loop.create_task(
-                            self.dispatcher.send_message(
-                                chat_id=user.id,
-                                text=await self.dispatcher.get_schedule(
-                                    user=user,
-                                    days=2,
-                                    search_id=int(user.subscription_id),
-                                    search_type=user.role,
-                                    show_location=user.show_location,
-                                    show_groups=user.show_groups,
-                                    text="Ваше расписание на сегодня и завтра\n\n",
-                                ),
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                        )
-                    elif user.subscription_days == "Эта неделя":
-                        self.loop.create_task(
-                            self.dispatcher.send_message(
-                                chat_id=user.id,
-                                text=await self.dispatcher.get_schedule(
-                                    user=user,
-                                    start_day=-1,
-                                    days=7,
-                                    search_id=int(user.subscription_id),
-                                    search_type=user.role,
-                                    show_location=user.show_location,
-                                    show_groups=user.show_groups,
-                                    text="Ваше расписание на 7 дней\n\n",
-                                ),
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                        )
-                    elif user.subscription_days == "Следующая неделя":
-                        self.loop.create_task(
-                            self.dispatcher.send_message(
-                                chat_id=user.id,
-                                text=await self.dispatcher.get_schedule(
-                                    user=user,
-                                    start_day=-2,
-                                    days=7,
-                                    search_id=int(user.subscription_id),
-                                    search_type=user.role,
-                                    show_location=user.show_location,
-                                    show_groups=user.show_groups,
-                                    text="Ваше расписание на следующую неделю\n\n",
-                                ),
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                        )
+                continue
+            if text is None:
+                continue
+            for user in users:
+                self.loop.create_task(
+                    self.dispatcher.send_message(
+                        chat_id=user.id,
+                        text=text,
+                        parse_mode=ParseMode.MARKDOWN,
+                        background=True,
+                    )
+                )
+
+    async def schedule_prefetch(self, time: datetime.datetime = None):
+        """
+        Заранее загружает в кэш расписание для подписок,
+        рассылка которых будет через prefetch_minutes минут
+
+        :param time: текущая минута, по умолчанию текущее время
+        :return:
+        """
+
+        now = datetime.datetime.now() if time is None else time
+        target = now + datetime.timedelta(minutes=self.prefetch_minutes)
+        if target.date() != now.date():
+            # Смещения дней в кэше считаются от текущей даты
+            return
+
+        subscriptions = {
+            user._replace(id=None)
+            for user in self.subscriptions.get(target.hour * 60 + target.minute)
+            if self.leases.owns(user.id)
+        }
+
+        await asyncio.gather(
+            *(self.subscription_schedule(user) for user in subscriptions)
+        )
+        log.debug("Prefetched %s schedules for %s", len(subscriptions), target)
+
+    async def reconcile_subscriptions(self):
+        """
+        Сверяет индекс подписчиков с базой
+
+        :return:
+        """
+
+        await self.model.flush()
+        await self.subscriptions.load()
+
+    async def subscription_schedule(self, user: UserFilteredByTime) -> list or None:
+        """
+        Формирует расписание по параметрам подписки пользователя
+
+        :param user:
+        :return: список частей сообщения или None, если вид подписки неизвестен
+        """
+
+        period = SUBSCRIPTION_PERIODS.get(user.subscription_days)
+        if period is None:
+            return None
+        return await self.dispatcher.get_schedule(
+            user=user,
+            start_day=period.start_day,
+            days=period.days,
+            search_id=int(user.subscription_id),
+            search_type=user.role,
+            show_location=user.show_location,
+            show_groups=user.show_groups,
+            text=period.text,
+        )
 
 
 class RESTfulService(AIOHTTPService):
-    __dependencies__ = ("db",)
-    db: Connection
+    __dependencies__ = ("model", "sender", "updates")
     model: Model
+    sender: MessageSender
+    updates: UpdateQueue
+    webhook_secret: str = None
 
     async def create_application(self):
         """
@@ -214,10 +522,14 @@ class RESTfulService(AIOHTTPService):
         :return:
         """
 
-        self.model = Model(self.db)
         app = aiohttp.web.Application()
         app.add_routes(
-            [aiohttp.web.get("/api/users_count", self.handler_user_count),]
+            [
+                aiohttp.web.get("/api/users_count", self.handler_user_count),
+                aiohttp.web.get("/api/send_queue", self.handler_send_queue),
+                aiohttp.web.get("/api/ruz_requests", self.handler_ruz_requests),
+                aiohttp.web.post("/telegram/api", self.handler_webhook),
+            ]
         )
 
         log.info("RESTful API started")
@@ -234,3 +546,47 @@ class RESTfulService(AIOHTTPService):
         count = await self.model.get_count_users()
 
         return aiohttp.web.json_response(dict(count=count))
+
+    async def handler_send_queue(self, request: Request) -> Response:
+        """
+        Обрабатывает запрос размера очереди отправки /api/send_queue
+
+        :return:
+        """
+
+        return aiohttp.web.json_response(dict(size=self.sender.queue_size))
+
+    async def handler_ruz_requests(self, request: Request) -> Response:
+        """
+        Обрабатывает запрос статистики объединенных запросов к RUZ /api/ruz_requests
+
+        :return:
+        """
+
+        return aiohttp.web.json_response(single_flight_stats())
+
+    async def handler_webhook(self, request: Request) -> Response:
+        """
+        Принимает обновления Telegram /telegram/api
+
+        Обновление ставится в очередь и обрабатывается в фоне,
+        при переполнении очереди Telegram повторит запрос позже.
+        Без заданного секрета все запросы отклоняются
+
+        :return:
+        """
+
+        if self.webhook_secret is None or not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.webhook_secret
+        ):
+            return Response(status=403)
+
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            # Тело не JSON или JSON не объект
+            return Response(status=400)
+
+        if not self.updates.put(update):
+            return Response(status=503)
+        return Response()
@@ -0,0 +1,168 @@
+import copy
+import json
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from app.dependency import Connection
+from app.model import FSMRecord
+from app.utils.lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+Address = Union[str, int, None]
+
+
+class StorageRecord(NamedTuple):
+    state: Optional[str] = None
+    data: dict = dict()
+    bucket: dict = dict()
+
+
+EMPTY = StorageRecord()
+
+
+class SQLStorage(BaseStorage):
+    """
+    Хранилище состояний aiogram FSM в базе с кэшем в памяти процесса
+
+    Записи читаются из кэша, изменения сразу записываются в базу, поэтому
+    состояние переживает перезапуск и доступно другим процессам. Обновления
+    одного чата обрабатывает один процесс, время жизни кэша ограничивает
+    устаревание записей, измененных в другом месте
+    """
+
+    db: Connection
+    cache: LRUCache
+
+    def __init__(self, db: Connection, cache_size: int = 10000, cache_ttl: int = 60):
+        """
+        :param db:
+        :param cache_size: максимальное количество записей в кэше
+        :param cache_ttl: время жизни записи в кэше, секунды
+        """
+
+        self.db = db
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def close(self):
+        self.cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def _get(
+        self, chat: Address, user: Address
+    ) -> Tuple[int, int, StorageRecord]:
+        """
+        Возвращает запись из кэша или базы
+
+        :param chat:
+        :param user:
+        :return: chat, user и запись
+        """
+
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        record = self.cache.get((chat, user))
+        if record is None:
+            async with self.db() as conn:
+                row = await (await conn.execute(FSMRecord.get(chat, user))).first()
+            if row is None:
+                record = EMPTY
+            else:
+                record = StorageRecord(
+                    state=row.state,
+                    data=json.loads(row.data) if row.data else dict(),
+                    bucket=json.loads(row.bucket) if row.bucket else dict(),
+                )
+            self.cache.set((chat, user), record)
+        return chat, user, record
+
+    async def _set(self, chat: int, user: int, record: StorageRecord) -> None:
+        """
+        Сохраняет запись в кэш и базу, пустая запись удаляется
+
+        :param chat:
+        :param user:
+        :param record:
+        :return:
+        """
+
+        if record == EMPTY:
+            sql = FSMRecord.remove(chat, user)
+        else:
+            sql = FSMRecord.save(
+                chat,
+                user,
+                state=record.state,
+                data=json.dumps(record.data, ensure_ascii=False),
+                bucket=json.dumps(record.bucket, ensure_ascii=False),
+            )
+        async with self.db() as conn:
+            await conn.execute(sql)
+        self.cache.set((chat, user), record)
+
+    async def get_state(
+        self, *, chat: Address = None, user: Address = None, default: str = None
+    ) -> Optional[str]:
+        _, _, record = await self._get(chat, user)
+        if record.state is None:
+            return self.resolve_state(default)
+        return record.state
+
+    async def get_data(
+        self, *, chat: Address = None, user: Address = None, default: dict = None
+    ) -> Dict:
+        _, _, record = await self._get(chat, user)
+        return copy.deepcopy(record.data)
+
+    async def set_state(
+        self, *, chat: Address = None, user: Address = None, state: str = None
+    ):
+        chat, user, record = await self._get(chat, user)
+        await self._set(chat, user, record._replace(state=self.resolve_state(state)))
+
+    async def set_data(
+        self, *, chat: Address = None, user: Address = None, data: Dict = None
+    ):
+        chat, user, record = await self._get(chat, user)
+        await self._set(chat, user, record._replace(data=copy.deepcopy(data or {})))
+
+    async def update_data(
+        self, *, chat: Address = None, user: Address = None, data: Dict = None, **kwargs
+    ):
+        chat, user, record = await self._get(chat, user)
+        await self._set(
+            chat, user, record._replace(data={**record.data, **(data or {}), **kwargs})
+        )
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(
+        self, *, chat: Address = None, user: Address = None, default: dict = None
+    ) -> Dict:
+        _, _, record = await self._get(chat, user)
+        return copy.deepcopy(record.bucket)
+
+    async def set_bucket(
+        self, *, chat: Address = None, user: Address = None, bucket: Dict = None
+    ):
+        chat, user, record = await self._get(chat, user)
+        await self._set(chat, user, record._replace(bucket=copy.deepcopy(bucket or {})))
+
+    async def update_bucket(
+        self,
+        *,
+        chat: Address = None,
+        user: Address = None,
+        bucket: Dict = None,
+        **kwargs,
+    ):
+        chat, user, record = await self._get(chat, user)
+        await self._set(
+            chat,
+            user,
+            record._replace(bucket={**record.bucket, **(bucket or {}), **kwargs}),
+        )
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import logging
+from typing import Dict, List, Set
+
+import sqlalchemy as sa
+
+from app.dependency import Connection
+from app.model import User, UserState, UserFilteredByTime
+
+log = logging.getLogger(__name__)
+
+# Поля пользователя, от которых зависит рассылка
+INDEXED_FIELDS = frozenset(
+    (
+        "role",
+        "subscription_time",
+        "subscription_days",
+        "subscription_id",
+        "show_location",
+        "show_groups",
+    )
+)
+
+
+class SubscriptionIndex:
+    """
+    Подписчики, разложенные по минутам рассылки, в памяти процесса
+
+    Загружается из базы при старте, обновляется при изменении пользователей
+    через Model и периодически сверяется с базой. Изменения, записанные
+    другими экземплярами бота, забираются из базы по времени изменения строки
+    """
+
+    db: Connection
+    # Время базы, с которого забираются изменения пользователей
+    since: datetime.datetime or None
+    _buckets: Dict[int, Dict[int, UserFilteredByTime]]
+    _minutes: Dict[int, int]
+    _updates: List[UserState] or None
+    # Устанавливается при любом изменении индекса
+    changed: asyncio.Event
+
+    def __init__(self, db: Connection) -> None:
+        self.db = db
+        self.since = None
+        self._buckets = dict()
+        self._minutes = dict()
+        self._updates = None
+        self.changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._minutes)
+
+    def get(self, minute: int) -> List[UserFilteredByTime]:
+        """
+        Подписчики с временем рассылки minute
+
+        :param minute: минуты от начала дня
+        :return:
+        """
+
+        return list(self._buckets.get(minute, dict()).values())
+
+    def minutes(self) -> Set[int]:
+        """
+        Минуты, на которые есть подписчики
+
+        :return:
+        """
+
+        return set(self._buckets)
+
+    async def load(self) -> None:
+        """
+        Загружает подписчиков из базы и заменяет ими текущий индекс
+
+        Изменения, пришедшие во время загрузки, применяются поверх
+
+        :return:
+        """
+
+        self._updates = list()
+        try:
+            async with self.db() as conn:
+                since = await conn.scalar(sa.select([sa.func.now()]))
+                rows = await (await conn.execute(User.subscribed_users())).fetchall()
+            buckets, minutes = dict(), dict()
+            for row in rows:
+                user = UserFilteredByTime(*row.as_tuple()[:-1])
+                minute = row.subscription_time
+                buckets.setdefault(minute, dict())[user.id] = user
+                minutes[user.id] = minute
+            self._buckets, self._minutes = buckets, minutes
+            for user in self._updates:
+                self.update(user)
+            self.since = since
+            self.changed.set()
+        finally:
+            self._updates = None
+        log.info("Subscription index loaded: %s subscribers", len(self))
+
+    async def refresh(self) -> None:
+        """
+        Применяет изменения пользователей, записанные в базу после прошлой
+        загрузки или обновления
+
+        Строки с тем же временем изменения забираются повторно, повторное
+        применение ничего не меняет
+
+        :return:
+        """
+
+        if self.since is None:
+            return
+        async with self.db() as conn:
+            rows = await (await conn.execute(User.changed_users(self.since))).fetchall()
+        for row in rows:
+            self.update(row)
+            if self._updates is not None:
+                self._updates.append(row)
+            self.since = max(self.since, row.updated)
+        if rows:
+            log.debug("Subscription index refreshed: %s users changed", len(rows))
+
+    def update(self, user: UserState) -> None:
+        """
+        Переносит пользователя в корзину его текущего времени рассылки
+
+        :param user:
+        :return:
+        """
+
+        self.remove(user.id)
+        self.changed.set()
+        if any(
+            item is None
+            for item in (
+                user.subscription_time,
+                user.subscription_days,
+                user.subscription_id,
+            )
+        ):
+            return
+        self._minutes[user.id] = user.subscription_time
+        self._buckets.setdefault(user.subscription_time, dict())[
+            user.id
+        ] = UserFilteredByTime(
+            id=user.id,
+            role=user.role,
+            subscription_days=user.subscription_days,
+            subscription_id=user.subscription_id,
+            show_location=user.show_location,
+            show_groups=user.show_groups,
+        )
+
+    def remove(self, id: int) -> None:
+        """
+        Убирает пользователя из индекса
+
+        :param id:
+        :return:
+        """
+
+        minute = self._minutes.pop(id, None)
+        if minute is not None:
+            bucket = self._buckets[minute]
+            del bucket[id]
+            if not bucket:
+                del self._buckets[minute]
+
+    def on_user_update(self, id: int, data: dict, user: UserState or None) -> None:
+        """
+        Слушатель изменений пользователей Model
+
+        :param id:
+        :param data: измененные поля
+        :param user: данные пользователя после изменения, если они известны
+        :return:
+        """
+
+        if INDEXED_FIELDS.isdisjoint(data):
+            return
+        if user is None:
+            # Без полных данных пользователь попадет в индекс при сверке с базой
+            self.remove(id)
+            log.debug("Target [CHAT_ID:%s]: deferred to reconciliation", id)
+            return
+        self.update(user)
+        if self._updates is not None:
+            self._updates.append(user)
@@ -0,0 +1,124 @@
+import inspect
+import logging
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Union
+
+from aiogram import types
+from aiogram.utils.callback_data import CallbackData
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable]
+
+
+class Route(NamedTuple):
+    handler: Handler
+    # Передавать ли обработчику разобранные данные как callback_data
+    with_data: bool
+
+
+class Prefix(NamedTuple):
+    callback: CallbackData
+    # Поле, по значению которого выбирается обработчик
+    field: Optional[str]
+    routes: Dict[str, Route]
+    # Обработчик для любых значений поля
+    default: Optional[Route]
+
+
+class CallbackRouter:
+    """
+    Таблица обработчиков callback запросов
+
+    Префикс callback_data и значение поля разбираются один раз, обработчик
+    выбирается поиском в словаре, а не проверкой фильтров по очереди
+    """
+
+    _prefixes: Dict[tuple, Prefix]
+    _separators: List[str]
+
+    def __init__(self) -> None:
+        self._prefixes = dict()
+        self._separators = list()
+
+    def register(
+        self,
+        handler: Handler,
+        callback: CallbackData,
+        **config: Union[str, List[str]],
+    ) -> None:
+        """
+        Регистрирует обработчик, аналог register_callback_query_handler
+        с фильтром callback.filter(**config)
+
+        :param handler:
+        :param callback:
+        :param config: не больше одного поля со значением или списком значений
+        :return:
+        """
+
+        if len(config) > 1:
+            raise ValueError("Only one field can be routed")
+
+        key = (callback.prefix, callback.sep)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = self._prefixes[key] = Prefix(
+                callback=callback,
+                field=next(iter(config), None),
+                routes=dict(),
+                default=None,
+            )
+            if callback.sep not in self._separators:
+                self._separators.append(callback.sep)
+        elif config and prefix.field != next(iter(config)):
+            raise ValueError(f"Prefix {callback.prefix!r} is routed by {prefix.field}")
+
+        route = Route(
+            handler=handler,
+            with_data="callback_data" in inspect.signature(handler).parameters,
+        )
+        if not config:
+            self._prefixes[key] = prefix._replace(default=route)
+            return
+        values = next(iter(config.values()))
+        for value in [values] if isinstance(values, str) else values:
+            prefix.routes[value] = route
+
+    def resolve(self, data: str) -> tuple:
+        """
+        Ищет обработчик callback_data
+
+        :param data:
+        :return: обработчик и разобранные данные или (None, None)
+        """
+
+        for separator in self._separators:
+            prefix = self._prefixes.get((data.split(separator, 1)[0], separator))
+            if prefix is None:
+                continue
+            try:
+                callback_data = prefix.callback.parse(data)
+            except ValueError:
+                return None, None
+            route = prefix.default
+            if prefix.field is not None:
+                route = prefix.routes.get(callback_data[prefix.field], route)
+            return route, callback_data
+        return None, None
+
+    async def __call__(self, query: types.CallbackQuery) -> None:
+        """
+        Передает callback запрос обработчику
+
+        :param query:
+        :return:
+        """
+
+        route, callback_data = self.resolve(query.data or "")
+        if route is None:
+            log.debug("Unhandled callback data %r", query.data)
+            return
+        if route.with_data:
+            await route.handler(query, callback_data=callback_data)
+        else:
+            await route.handler(query)
@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш в памяти процесса с временем жизни записей
+    """
+
+    maxsize: int
+    ttl: float or None
+    hits: int
+    misses: int
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Возвращает значение по ключу, если оно есть и не устарело
+
+        :param key:
+        :param default:
+        :return:
+        """
+
+        item = self._data.get(key)
+        if item is not None:
+            expires, value = item
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохраняет значение, вытесняя самые давние записи при переполнении
+
+        :param key:
+        :param value:
+        :return:
+        """
+
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Удаляет запись и возвращает ее значение, если оно не устарело
+
+        :param key:
+        :param default:
+        :return:
+        """
+
+        item = self._data.pop(key, None)
+        if item is None or (item[0] is not None and item[0] <= time.monotonic()):
+            return default
+        return item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from aiogram import types
+
+log = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает секрет, заданный в setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: types.Update) -> int:
+    """
+    Чат, к которому относится обновление, для сохранения порядка обработки
+
+    :param update:
+    :return: id чата, пользователя или, если их нет, id обновления
+    """
+
+    for message in (
+        update.message,
+        update.edited_message,
+        update.channel_post,
+        update.edited_channel_post,
+    ):
+        if message is not None:
+            return message.chat.id
+    if update.callback_query is not None:
+        if update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    for event in (
+        update.my_chat_member,
+        update.chat_member,
+        update.chat_join_request,
+    ):
+        if event is not None:
+            return event.chat.id
+    for event in (
+        update.inline_query,
+        update.chosen_inline_result,
+        update.shipping_query,
+        update.pre_checkout_query,
+    ):
+        if event is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """
+    Очередь обновлений, полученных через webhook
+
+    Обновления обрабатываются пулом из workers задач, обновления одного чата
+    всегда попадают к одной задаче и обрабатываются по порядку. Размер очереди
+    ограничен, при переполнении обновление не принимается и Telegram повторит
+    его позже
+    """
+
+    workers: int
+    _queues: "List[asyncio.Queue[types.Update]]"
+    _tasks: List[asyncio.Task]
+    _handler: Optional[Callable[[types.Update], Awaitable]]
+
+    def __init__(self, maxsize: int = 1000, workers: int = 16) -> None:
+        self.workers = workers
+        self._queues = [
+            asyncio.Queue(maxsize=max(maxsize // workers, 1)) for _ in range(workers)
+        ]
+        self._tasks = list()
+        self._handler = None
+
+    @property
+    def size(self) -> int:
+        """
+        Количество обновлений, ожидающих обработки
+
+        :return:
+        """
+
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self, handler: Callable[[types.Update], Awaitable]) -> None:
+        """
+        Запускает обработчиков очереди
+
+        :param handler: обработчик обновления, например Dispatcher.process_update
+        :return:
+        """
+
+        self._handler = handler
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._work(queue)) for queue in self._queues]
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Дожидается обработки очереди и останавливает обработчиков
+
+        :param timeout: максимальное время ожидания очереди
+        :return:
+        """
+
+        if self._tasks:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues)),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                log.warning("Dropped %s webhook updates", self.size)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+
+    def put(self, update: types.Update) -> bool:
+        """
+        Ставит обновление в очередь
+
+        :param update:
+        :return: False, если очередь переполнена или не запущена
+        """
+
+        if not self._tasks:
+            return False
+        try:
+            self._queue(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put_wait(self, update: types.Update) -> None:
+        """
+        Ставит обновление в очередь, дожидаясь свободного места
+
+        :param update:
+        :return:
+        """
+
+        await self._queue(update).put(update)
+
+    def _queue(self, update: types.Update) -> "asyncio.Queue[types.Update]":
+        return self._queues[update_chat_id(update) % self.workers]
+
+    async def _work(self, queue: "asyncio.Queue[types.Update]") -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self._handler(update)
+            except Exception:
+                log.exception("Cause exception while processing update %s", update)
+            finally:
+                queue.task_done()
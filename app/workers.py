@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from multiprocessing.connection import Connection
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from aiogram import types
+
+from app.sender import MessageSender
+from app.webhook import UpdateQueue, update_chat_id
+
+log = logging.getLogger(__name__)
+
+
+class ShardedUpdates:
+    """
+    Распределяет обновления между процессами-обработчиками по id чата
+
+    Обновления одного чата всегда попадают в один процесс и обрабатываются
+    по порядку. Каждый процесс запускает свой BotDispatcher и пул соединений
+    с базой, обновления передаются через multiprocessing.Pipe. Обратно по
+    отдельному каналу процессы присылают изменения подписок пользователей
+    """
+
+    config: dataclass
+    processes: List[multiprocessing.Process]
+    # Вызывается с (id, data, UserState или None) для изменений из процессов
+    on_user_update: Optional[Callable[[int, dict, Any], None]]
+    _connections: List[Connection]
+    _events: List[Connection]
+    _queues: "List[asyncio.Queue[types.Update]]"
+    _tasks: List[asyncio.Task]
+
+    def __init__(
+        self,
+        config: dataclass,
+        maxsize: int = 1000,
+        on_user_update: Callable[[int, dict, Any], None] = None,
+    ) -> None:
+        self.config = config
+        self.processes = list()
+        self.on_user_update = on_user_update
+        self._connections = list()
+        self._events = list()
+        self._queues = [
+            asyncio.Queue(maxsize=max(maxsize // config.workers, 1))
+            for _ in range(config.workers)
+        ]
+        self._tasks = list()
+
+    @property
+    def workers(self) -> int:
+        return len(self._queues)
+
+    @property
+    def size(self) -> int:
+        """
+        Количество обновлений, ожидающих передачи в процессы
+
+        :return:
+        """
+
+        return sum(queue.qsize() for queue in self._queues)
+
+    def spawn(self) -> None:
+        """
+        Запускает процессы-обработчики
+
+        Ограничение частоты отправки делится поровну между процессами
+        и этим процессом, который рассылает подписки
+
+        :return:
+        """
+
+        # app импортирует сервисы, которые зависят от этого модуля
+        from app import start_worker
+
+        config = replace(
+            self.config,
+            workers=1,
+            webhook=False,
+            send_rate_limit=self.config.send_rate_limit / (self.config.workers + 1),
+        )
+        context = multiprocessing.get_context("spawn")
+        for number in range(self.workers):
+            receiver, sender = context.Pipe(duplex=False)
+            events_receiver, events_sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=start_worker,
+                args=(config, receiver, events_sender),
+                name=f"bot-worker-{number}",
+                daemon=True,
+            )
+            process.start()
+            receiver.close()
+            events_sender.close()
+            self.processes.append(process)
+            self._connections.append(sender)
+            self._events.append(events_receiver)
+        log.info("Started %s bot workers", self.workers)
+
+    def start(self, handler: Callable[[types.Update], Awaitable] = None) -> None:
+        """
+        Запускает передачу обновлений в процессы
+
+        :param handler: не используется, обновления обрабатывают процессы
+        :return:
+        """
+
+        loop = asyncio.get_event_loop()
+        self._tasks = [
+            loop.create_task(self._forward(queue, connection))
+            for queue, connection in zip(self._queues, self._connections)
+        ]
+        self._tasks.extend(
+            loop.create_task(self._receive_events(connection))
+            for connection in self._events
+        )
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Передает оставшиеся обновления и останавливает процессы
+
+        :param timeout: максимальное время ожидания очереди и процессов
+        :return:
+        """
+
+        if self._tasks:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues)),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                log.warning("Dropped %s updates for bot workers", self.size)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+
+        # Процесс завершается, получив конец канала
+        for connection in self._connections:
+            connection.close()
+        self._connections = list()
+        loop = asyncio.get_event_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = list()
+        for connection in self._events:
+            connection.close()
+        self._events = list()
+
+    def put(self, update: types.Update) -> bool:
+        """
+        Ставит обновление в очередь процесса его чата
+
+        :param update:
+        :return: False, если очередь переполнена или не запущена
+        """
+
+        if not self._tasks:
+            return False
+        try:
+            self._queue(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put_wait(self, update: types.Update) -> None:
+        """
+        Ставит обновление в очередь процесса его чата, дожидаясь свободного места
+
+        :param update:
+        :return:
+        """
+
+        await self._queue(update).put(update)
+
+    async def _receive_events(self, connection: Connection) -> None:
+        """
+        Принимает изменения пользователей от процесса-обработчика
+
+        :param connection:
+        :return:
+        """
+
+        try:
+            async for id, data, user in receive(connection):
+                if self.on_user_update is None:
+                    continue
+                try:
+                    self.on_user_update(id, data, user)
+                except Exception:
+                    log.exception("Cause exception while applying user update %s", id)
+        except (EOFError, OSError):
+            return
+
+    def share_send_rate(self, parts: int) -> None:
+        """
+        Передает процессам количество экземпляров бота, между которыми
+        делится ограничение частоты отправки
+
+        :param parts:
+        :return:
+        """
+
+        for queue in self._queues:
+            asyncio.ensure_future(queue.put(("share", parts)))
+
+    def _queue(self, update: types.Update) -> "asyncio.Queue[types.Update]":
+        return self._queues[update_chat_id(update) % self.workers]
+
+    @staticmethod
+    async def _forward(
+        queue: "asyncio.Queue[types.Update]", connection: Connection
+    ) -> None:
+        loop = asyncio.get_event_loop()
+        # Запись в канал может ждать, пока процесс прочитает предыдущие
+        # обновления, поэтому у каждого канала свой поток, а не общий пул
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forward")
+        try:
+            while True:
+                update = await queue.get()
+                # Кроме обновлений по каналу передаются команды вида (имя, значение)
+                if isinstance(update, types.Update):
+                    update = update.to_python()
+                try:
+                    await loop.run_in_executor(executor, connection.send, update)
+                except Exception:
+                    log.exception("Cause exception while forwarding update %s", update)
+                finally:
+                    queue.task_done()
+        finally:
+            executor.shutdown(wait=False)
+
+
+async def receive(connection: Connection) -> AsyncIterator[Any]:
+    """
+    Читает объекты из канала в цикле событий, не занимая потоки пула
+
+    Готовность канала ожидается через add_reader, recv вызывается,
+    только когда poll сообщает о данных
+
+    :param connection:
+    :return:
+    :raises EOFError: когда другой конец канала закрыт
+    """
+
+    loop = asyncio.get_event_loop()
+    fileno = connection.fileno()
+    ready = asyncio.Event()
+    loop.add_reader(fileno, ready.set)
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            while connection.poll():
+                yield connection.recv()
+    finally:
+        loop.remove_reader(fileno)
+
+
+async def receive_updates(
+    connection: Connection, updates: UpdateQueue, sender: MessageSender
+) -> None:
+    """
+    Принимает обновления от процесса, получающего их от Telegram
+
+    Когда канал закрывается, останавливает цикл событий процесса
+
+    :param connection:
+    :param updates: очередь обработки обновлений процесса
+    :param sender: очередь отправки процесса
+    :return:
+    """
+
+    try:
+        async for data in receive(connection):
+            if isinstance(data, tuple):
+                name, value = data
+                if name == "share":
+                    sender.share(value)
+                continue
+            await updates.put_wait(types.Update(**data))
+    except (EOFError, OSError):
+        log.info("Update stream closed, stopping bot worker")
+        asyncio.get_event_loop().stop()
+
+
+def send_user_updates(connection: Connection) -> Callable[[int, dict, Any], None]:
+    """
+    Создает слушатель Model, передающий изменения подписок процессу,
+    который рассылает подписки
+
+    :param connection: канал в процесс, получающий обновления от Telegram
+    :return:
+    """
+
+    # app.subscriptions зависит от app.model, который импортирует этот модуль
+    from app.subscriptions import INDEXED_FIELDS
+
+    def listener(id: int, data: dict, user: Any) -> None:
+        if INDEXED_FIELDS.isdisjoint(data):
+            return
+        # Сообщения маленькие, а канал постоянно читается, поэтому send не блокирует
+        try:
+            connection.send((id, data, user))
+        except (OSError, ValueError):
+            log.warning("Target [CHAT_ID:%s]: subscription update not forwarded", id)
+
+    return listener
@@ -9,12 +9,29 @@ class Config:
     token: str = getenv("TOKEN") or None
     host: str = getenv("HOST") or "tg.uname.su"
     listen: str = getenv("LISTEN") or "0.0.0.0"
+    port: int = int(getenv("PORT") or 8080)
+    webhook: bool = getenv("WEBHOOK") == "True"
+    webhook_secret: str = getenv("WEBHOOK_SECRET") or None
+    webhook_workers: int = int(getenv("WEBHOOK_WORKERS") or 16)
+    webhook_queue_size: int = int(getenv("WEBHOOK_QUEUE_SIZE") or 1000)
+    workers: int = int(getenv("WORKERS") or 1)
     db_host: str = getenv("DB_HOST") or "localhost"
     db_port: int = int(getenv("DB_PORT") or 5432)
     db_user: str = getenv("DB_USER") or "root"
     db_password: str = getenv("DB_PASSWORD") or "password"
     db_database: str = getenv("DB_DATABASE") or "bot"
     db_connect_timeout: int = 18000
+    db_write_behind: bool = getenv("DB_WRITE_BEHIND") == "True"
+    db_flush_interval: int = int(getenv("DB_FLUSH_INTERVAL") or 100)
+    db_flush_size: int = int(getenv("DB_FLUSH_SIZE") or 100)
+    ruz_limit_per_host: int = int(getenv("RUZ_LIMIT_PER_HOST") or 20)
+    ruz_dns_cache_ttl: int = int(getenv("RUZ_DNS_CACHE_TTL") or 300)
+    ruz_fast_parser: bool = getenv("RUZ_FAST_PARSER") != "False"
+    ruz_timeout: float = float(getenv("RUZ_TIMEOUT") or 10)
+    subscription_partitions: int = int(getenv("SUBSCRIPTION_PARTITIONS") or 16)
+    subscription_lease_ttl: int = int(getenv("SUBSCRIPTION_LEASE_TTL") or 30)
+    send_rate_limit: float = float(getenv("SEND_RATE_LIMIT") or 30)
+    send_chat_rate_limit: float = float(getenv("SEND_CHAT_RATE_LIMIT") or 1)
     debug: bool = getenv("DEBUG") != "False"
 
     @property
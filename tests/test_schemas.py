@@ -0,0 +1,116 @@
+import pytest
+from marshmallow import ValidationError
+
+from app.ruz.schemas import ScheduleSchema, parse_schedule
+
+
+def pair(**fields) -> dict:
+    """
+    Пара в формате ответа RUZ
+
+    :param fields: поля, заменяющие значения по умолчанию
+    :return:
+    """
+
+    data = {
+        "beginLesson": "10:10",
+        "endLesson": "11:40",
+        "discipline": "Математический анализ",
+        "kindOfWork": "Лекция",
+        "group": "ПИ19-1",
+        "stream": None,
+        "auditorium": "ЛП49/405_a",
+        "building": "Ленинградский пр. 49",
+        "lecturer": "Иванов И.И.",
+        "date": "2026.10.19",
+        "note": None,
+        "url1": "",
+        "url1_description": "",
+        "url2": "",
+        "url2_description": "",
+    }
+    data.update(fields)
+    return data
+
+
+def schema_load(pairs):
+    return ScheduleSchema().load({"pairs": pairs})
+
+
+PAYLOADS = {
+    "empty": [],
+    "one pair": [pair()],
+    "empty fields": [
+        pair(
+            discipline="",
+            kindOfWork="",
+            auditorium="",
+            building="",
+            lecturer="",
+            url1="",
+        )
+    ],
+    "none fields": [
+        pair(
+            discipline=None,
+            kindOfWork=None,
+            auditorium=None,
+            building=None,
+            lecturer=None,
+            note=None,
+            url1=None,
+            url1_description=None,
+            url2=None,
+            url2_description=None,
+        )
+    ],
+    "stream instead of group": [pair(group=None, stream="ПИ19-1, ПИ19-2")],
+    "no group and stream": [pair(group=None, stream=None)],
+    "multi group": [pair(group="ПИ19-3, ПИ19-1,ПИ19-2")],
+    "note and urls": [
+        pair(
+            note="Онлайн",
+            url1="https://example.com/1",
+            url1_description="Лекция",
+            url2="https://example.com/2",
+            url2_description="Запись",
+        )
+    ],
+    "parallel pairs": [
+        pair(group="ПИ19-1", auditorium="ЛП49/405", lecturer="Иванов И.И."),
+        pair(group="ПИ19-2", auditorium="ЛП49/406", lecturer="Петров П.П."),
+    ],
+    "several days": [
+        pair(beginLesson="13:30", endLesson="15:00"),
+        pair(),
+        pair(date="2026.10.20", discipline="Философия"),
+        pair(discipline="Экономика"),
+    ],
+}
+
+MALFORMED = {
+    "not a list": {"pairs": []},
+    "none": None,
+    "string": "[]",
+    "pair is not an object": [1],
+    "missing time": [{k: v for k, v in pair().items() if k != "beginLesson"}],
+    "none time": [pair(beginLesson=None)],
+    "missing group": [{k: v for k, v in pair().items() if k != "group"}],
+    "name is not a string": [pair(discipline=5)],
+    "note is not a string": [pair(note=3)],
+    "bad date": [pair(date="19.10.2026")],
+    "none date": [pair(date=None)],
+}
+
+
+@pytest.mark.parametrize("pairs", PAYLOADS.values(), ids=PAYLOADS.keys())
+def test_parse_schedule_matches_schema(pairs):
+    assert parse_schedule(pairs) == schema_load(pairs)
+
+
+@pytest.mark.parametrize("pairs", MALFORMED.values(), ids=MALFORMED.keys())
+def test_parse_schedule_rejects_malformed(pairs):
+    with pytest.raises(Exception):
+        schema_load(pairs)
+    with pytest.raises(ValidationError):
+        parse_schedule(pairs)
@@ -0,0 +1,28 @@
+import asyncio
+
+from app.sender import MessageSender, TokenBucket
+
+
+def test_fractional_rate_acquires():
+    bucket = TokenBucket(0.8, capacity=0.8)
+
+    assert bucket.capacity == 1
+    asyncio.run(asyncio.wait_for(bucket.acquire(), timeout=1))
+    assert 1.2 < bucket.delay() <= 1.25
+
+
+def test_fractional_shared_rate_acquires():
+    sender = MessageSender(bot=None, rate=30 / 9)
+    sender.share(4)
+
+    assert sender._bucket.rate < 1
+    assert sender._bucket.capacity == 1
+    asyncio.run(asyncio.wait_for(sender._bucket.acquire(), timeout=1))
+
+
+def test_set_rate_keeps_tokens_within_capacity():
+    bucket = TokenBucket(30, capacity=30)
+    bucket.set_rate(0.5)
+
+    assert bucket.capacity == 1
+    assert bucket.tokens == 1